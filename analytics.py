@@ -0,0 +1,244 @@
+# Колоночный движок агрегатов для main.py: ключевые колонки выгрузки кодируются словарём один раз
+# при конвертации выгрузки (dataset_store), а топ-N, количества и суммы по ключу считаются редукциями numpy
+# по массивам кодов. Все построенные массивы сохраняются в хранилище и открываются процессами через mmap.
+import threading
+
+import numpy as np
+import pandas as pd
+
+_NO_ROWS = np.empty(0, dtype=np.intp)
+
+
+def encode(column):
+    """Коды строк (-1 - пустое значение) и словарь значений по возрастанию."""
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        # Колонки хранилища уже закодированы: коды берутся как есть, без копирования
+        return column.cat.codes.to_numpy(), column.cat.categories
+    codes, labels = pd.factorize(column, sort=True)
+    return codes, pd.Index(labels)
+
+
+def label_strings(labels):
+    """Значения ключа строками; целые, прочитанные как float (колонка с пропусками), - без '.0'."""
+    if labels.dtype.kind == 'f' and np.all(np.mod(labels.to_numpy(), 1) == 0):
+        labels = labels.astype(np.int64)
+    return labels.astype(str).to_numpy()
+
+
+class GroupIndex:
+    """Строки выгрузки, сгруппированные по ключу из одной или нескольких колонок.
+
+    Хранит коды групп, размеры групп, позиции строк, упорядоченные по группам, и порядок групп
+    по убыванию размера - запросы к индексу работают за время, пропорциональное ответу.
+    """
+
+    def __init__(self, codes, labels):
+        self.codes = codes
+        self.labels = labels
+        valid = codes >= 0
+        self.counts = np.bincount(codes[valid], minlength=len(labels))
+        # Позиции строк группы code - rows[offsets[code]:offsets[code + 1]]
+        order = np.argsort(codes, kind='stable')
+        self._rows = order[len(codes) - int(valid.sum()):]
+        self._offsets = np.concatenate(([0], np.cumsum(self.counts)))
+        self.by_count = np.argsort(-self.counts, kind='stable')
+
+    def arrays(self):
+        """Массивы индекса для хранилища; значения ключа - по массиву на колонку (level0, level1, ...)."""
+        levels = [self.labels] if self.labels.nlevels == 1 else \
+            [self.labels.get_level_values(i) for i in range(self.labels.nlevels)]
+        arrays = {'codes': self.codes, 'counts': self.counts, 'rows': self._rows, 'offsets': self._offsets,
+                  'by_count': self.by_count}
+        arrays.update((f'level{i}', level.to_numpy()) for i, level in enumerate(levels))
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, columns, arrays):
+        """Индекс из массивов arrays() без пересчёта."""
+        group = cls.__new__(cls)
+        levels = [arrays[f'level{i}'] for i in range(len(columns))]
+        group.labels = pd.Index(levels[0]) if len(columns) == 1 else \
+            pd.MultiIndex.from_arrays(levels, names=list(columns))
+        group.codes, group.counts, group.by_count = arrays['codes'], arrays['counts'], arrays['by_count']
+        group._rows, group._offsets = arrays['rows'], arrays['offsets']
+        return group
+
+    @classmethod
+    def from_columns(cls, frame, columns):
+        if len(columns) == 1:
+            return cls(*encode(frame[columns[0]]))
+        encoded = [encode(frame[name]) for name in columns]
+        codes = [c for c, _ in encoded]
+        valid = np.logical_and.reduce([c >= 0 for c in codes])
+        # Составной ключ - номер в смешанной системе счисления, затем плотная перенумерация
+        combined = np.ravel_multi_index([np.where(valid, c, 0) for c in codes],
+                                        [max(len(labels), 1) for _, labels in encoded])
+        uniques, inverse = np.unique(combined[valid], return_inverse=True)
+        group_codes = np.full(len(combined), -1, dtype=np.intp)
+        group_codes[valid] = inverse
+        parts = np.unravel_index(uniques, [max(len(labels), 1) for _, labels in encoded])
+        labels = pd.MultiIndex.from_arrays([labels[part] for (_, labels), part in zip(encoded, parts)],
+                                           names=columns)
+        return cls(group_codes, labels)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def rows(self, code):
+        """Позиции строк группы."""
+        return self._rows[self._offsets[code]:self._offsets[code + 1]]
+
+    def sums(self, values):
+        """Суммы values по группам (пустые значения пропускаются, как в groupby().sum())."""
+        values = np.asarray(values, dtype=np.float64)
+        valid = (self.codes >= 0) & ~np.isnan(values)
+        return np.bincount(self.codes[valid], weights=values[valid], minlength=len(self.labels))
+
+
+class KeyIndex:
+    """Значение ключа (строкой) -> позиции строк в виде массивов numpy.
+
+    Ключи по возрастанию, позиции строк ключа i - rows[offsets[i]:offsets[i + 1]] по возрастанию.
+    get() - точное совпадение за O(log n) плюс размер ответа, prefix() - все значения с префиксом.
+    """
+
+    def __init__(self, keys, offsets, rows):
+        self.keys = keys
+        self.offsets = offsets
+        self.rows = rows
+
+    @classmethod
+    def from_pairs(cls, keys, rows):
+        """Индекс по парам (значение ключа строкой, позиция строки); повторы пар убираются."""
+        keys = np.asarray(keys, dtype=str)
+        rows = np.asarray(rows, dtype=np.intp)
+        order = np.lexsort((rows, keys))
+        keys, rows = keys[order], rows[order]
+        keep = np.ones(len(keys), dtype=bool)
+        keep[1:] = (keys[1:] != keys[:-1]) | (rows[1:] != rows[:-1])
+        keys, rows = keys[keep], rows[keep]
+        unique, starts = np.unique(keys, return_index=True)
+        return cls(unique, np.append(starts, len(keys)).astype(np.int64), rows)
+
+    @classmethod
+    def from_group(cls, group):
+        valid = group.codes >= 0
+        return cls.from_pairs(label_strings(group.labels)[group.codes[valid]], np.flatnonzero(valid))
+
+    def arrays(self):
+        return {'keys': self.keys, 'offsets': self.offsets, 'rows': self.rows}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _range(self, start, stop):
+        return self.rows[self.offsets[start]:self.offsets[stop]]
+
+    def get(self, key):
+        i = int(np.searchsorted(self.keys, key))
+        return self._range(i, i + 1) if i < len(self.keys) and self.keys[i] == key else _NO_ROWS
+
+    def prefix(self, prefix):
+        start = int(np.searchsorted(self.keys, prefix))
+        stop = int(np.searchsorted(self.keys, prefix + '\uffff'))
+        if stop - start <= 1:
+            return self._range(start, stop)
+        # Позиции нескольких ключей сливаются в порядке строк выгрузки
+        return np.sort(self._range(start, stop))
+
+    def find(self, key, match='exact'):
+        return self.prefix(key) if match == 'prefix' else self.get(key)
+
+
+class Analytics:
+    """Группировки и агрегаты одного снимка выгрузки.
+
+    Индексы групп и производные массивы строятся при первом обращении и запоминаются;
+    warm() строит их заранее, export() отдаёт построенное для хранилища, а memo - восстановленное
+    из него (restore).
+    """
+
+    def __init__(self, frame, memo=None):
+        self.frame = frame
+        self._memo = dict(memo or {})
+        self._lock = threading.RLock()  # Построение одних массивов обращается к другим
+
+    def _cached(self, key, build):
+        value = self._memo.get(key)
+        if value is None:
+            with self._lock:
+                value = self._memo.get(key)
+                if value is None:
+                    value = self._memo[key] = build()
+        return value
+
+    def group(self, *columns):
+        return self._cached(('group', columns), lambda: GroupIndex.from_columns(self.frame, columns))
+
+    def _sum_order(self, columns, value_column):
+        def build():
+            sums = self.group(*columns).sums(self.frame[value_column])
+            return sums, np.argsort(-sums, kind='stable')
+        return self._cached(('sum', columns, value_column), build)
+
+    def top_counts(self, columns, n):
+        """Топ-n групп по количеству строк - как value_counts().nlargest(n)."""
+        group = self.group(*columns)
+        top = group.by_count[:n]
+        return pd.Series(group.counts[top], index=group.labels[top], name='count')
+
+    def top_sums(self, columns, value_column, n):
+        """Топ-n групп по сумме value_column - как groupby(columns)[value_column].sum().nlargest(n)."""
+        group = self.group(*columns)
+        sums, order = self._sum_order(columns, value_column)
+        top = order[:n]
+        return pd.Series(sums[top], index=group.labels[top], name=value_column)
+
+    def counts_by_label(self, column):
+        """Значения колонки строками по возрастанию и их количества (для постраничной выдачи)."""
+        def build():
+            group = self.group(column)
+            labels = label_strings(group.labels)
+            order = np.argsort(labels, kind='stable')
+            return labels[order], group.counts[order]
+        return self._cached(('labels', column), build)
+
+    def key_index(self, column):
+        """Индекс позиций строк по значению колонки (KeyIndex)."""
+        return self._cached(('keys', column), lambda: KeyIndex.from_group(self.group(column)))
+
+    def warm(self, counts=(), sums=(), labels=(), keys=()):
+        """Строит заранее группировки для top_counts (counts), top_sums (пары columns, value_column),
+        counts_by_label (labels) и key_index (keys)."""
+        for columns in counts:
+            self.group(*columns)
+        for columns, value_column in sums:
+            self._sum_order(columns, value_column)
+        for column in labels:
+            self.counts_by_label(column)
+        for column in keys:
+            self.key_index(column)
+        return self
+
+    def export(self):
+        """Построенные индексы и массивы: пары (ключ memo, {имя: массив})."""
+        items = []
+        for key, value in list(self._memo.items()):
+            if isinstance(value, (GroupIndex, KeyIndex)):
+                items.append((key, value.arrays()))
+            else:  # Кортежи массивов: (суммы, порядок) и (значения, количества)
+                items.append((key, {str(i): array for i, array in enumerate(value)}))
+        return items
+
+    @staticmethod
+    def restore(items):
+        """memo для Analytics из пар export()."""
+        memo = {}
+        for key, arrays in items:
+            if key[0] == 'group':
+                memo[key] = GroupIndex.from_arrays(key[1], arrays)
+            elif key[0] == 'keys':
+                memo[key] = KeyIndex(**arrays)
+            else:
+                memo[key] = tuple(arrays[str(i)] for i in range(len(arrays)))
+        return memo
@@ -0,0 +1,139 @@
+# Построение графиков для *_plot.jpg: объектный API matplotlib (Figure + Agg) без глобального
+# состояния pyplot, отрисовка в пуле процессов, готовые картинки кэшируются по версии данных.
+import asyncio
+import io
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from fastapi.responses import Response
+from matplotlib.figure import Figure
+
+from response_cache import ResponseCache
+
+# Процессов отрисовки; картинок в кэше и их время жизни, секунды (ключ и так содержит версию данных)
+CHART_WORKERS = 2
+CHART_CACHE_SIZE = 256
+CHART_CACHE_TTL = 24 * 60 * 60
+MEDIA_TYPE = 'image/jpeg'
+
+
+def _jpeg(fig):
+    buf = io.BytesIO()
+    fig.savefig(buf, format='jpg', bbox_inches='tight')
+    return buf.getvalue()
+
+
+def bar_chart(labels, values, title, xlabel, ylabel, color, figsize):
+    """Столбчатая диаграмма (как Series.plot(kind='bar')) в JPEG."""
+    fig = Figure(figsize=figsize)
+    ax = fig.subplots()
+    positions = range(len(labels))
+    ax.bar(positions, values, color=color, width=0.5)
+    ax.set_xticks(positions, labels, rotation=45, ha='right')
+    ax.set_title(title, fontsize=16)
+    ax.set_xlabel(xlabel, fontsize=14)
+    ax.set_ylabel(ylabel, fontsize=14)
+    ax.grid(axis='y', linestyle='--', alpha=0.7)
+    # Использование tight_layout для автоматической настройки отступов
+    fig.tight_layout()
+    return _jpeg(fig)
+
+
+def scatter_chart(x, y, title, xlabel, ylabel):
+    """Точечный график в JPEG."""
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    ax.scatter(x, y, color='blue')
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.tick_params(axis='x', labelrotation=45)
+    ax.grid()
+    return _jpeg(fig)
+
+
+class ChartService:
+    """Отрисовка графиков в пуле процессов с кэшем готовых JPEG.
+
+    Функции отрисовки (bar_chart, scatter_chart) получают уже подготовленные данные - списки
+    или массивы numpy, поэтому в процессы пула передаются только они.
+    Эндпоинт сначала проверяет cache.get(key) и только при промахе готовит данные и вызывает render.
+    """
+
+    def __init__(self, workers=CHART_WORKERS):
+        self.workers = workers
+        self.cache = ResponseCache(size=CHART_CACHE_SIZE, ttl=CHART_CACHE_TTL)
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self):
+        with self._lock:
+            if self._pool is None:
+                # spawn: процессы отрисовки не наследуют потоки и данные API
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._pool
+
+    def _discard(self, pool):
+        """Убирает пул, в котором умер процесс (BrokenProcessPool): следующее обращение к pool создаст новый."""
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _store(self, key, image):
+        return self.cache.put(key, Response(image, media_type=MEDIA_TYPE))
+
+    async def render(self, key, fn, *args):
+        """Отрисовывает fn(*args) в пуле, кэширует и возвращает Response; event loop не блокируется."""
+        pool = self.pool
+        try:
+            image = await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+        except BrokenProcessPool:
+            self._discard(pool)
+            raise
+        return self._store(key, image)
+
+    def render_sync(self, key, fn, *args):
+        """То же для синхронных эндпоинтов (они и так выполняются в пуле потоков FastAPI)."""
+        pool = self.pool
+        try:
+            image = pool.submit(fn, *args).result()
+        except BrokenProcessPool:
+            self._discard(pool)
+            raise
+        return self._store(key, image)
+
+    def prerender(self, jobs):
+        """Отрисовывает в фоне графики jobs - пары (key, (fn, *args)) - и кладёт их в кэш."""
+        pool = self.pool
+        for key, (fn, *args) in jobs:
+            try:
+                future = pool.submit(fn, *args)
+            except BrokenProcessPool:
+                self._discard(pool)
+                print("Chart prerender stopped: process pool is broken")
+                return
+            future.add_done_callback(self._prerendered(pool, key))
+
+    def _prerendered(self, pool, key):
+        def done(future):
+            if future.cancelled():
+                return
+            if future.exception() is None:
+                self._store(key, future.result())
+            else:
+                if isinstance(future.exception(), BrokenProcessPool):
+                    self._discard(pool)
+                print(f"Chart prerender failed: {key}: {future.exception()}")
+        return done
+
+    def clear(self, version=None):
+        self.cache.clear(version)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
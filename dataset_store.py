@@ -0,0 +1,298 @@
+# Колоночное хранилище выгрузки для main.py: выгрузка один раз раскладывается в файлы .npy,
+# которые все процессы API открывают через mmap без копирования. Рядом с колонками так же хранятся
+# индексы поверх них (участники, поиск поставщиков, группировки analytics) - процессы их не строят.
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import analytics
+import import_util
+import supplier_search
+
+# Профиль типов колонок выгрузки. Строковые колонки, не перечисленные здесь, хранятся в зависимости
+# от числа различных значений (CATEGORY_MAX_SHARE): category - коды минимальной ширины и словарь значений
+# (регион, закон, КПГЗ), иначе - смещения и общий буфер UTF-8 (ссылки, списки участников, наименования СТЕ)
+DATE_COLUMNS = ('Начало КС', 'Окончание КС', 'Начало действия оферты', 'Окончание действия оферты')
+# ИНН - числа: int64, а при пропусках float64 (точно хранит 12 цифр и занимает столько же)
+INN_COLUMNS = ('ИНН заказчика', 'ИНН победителя КС')
+# Цены за единицу в выгрузке - строки с десятичной запятой ('857,84'); суммы денег остаются float64
+DECIMAL_COLUMNS = ('Стоимость за единицу СТЕ', 'Цена оферты за единицу')
+# Количества - наименьшее подходящее целое, при пропусках float32 (точен для целых до 2**24)
+COUNT_COLUMNS = ('Количество СТЕ',)
+# Строковая колонка хранится как category, если различных значений не больше этой доли непустых
+CATEGORY_MAX_SHARE = 0.1
+MANIFEST = 'manifest.json'
+# Версия раскладки; хранилища другой версии пересобираются
+FORMAT = 4
+
+# Индексы хранилища: участники КС (ИНН -> строки), поиск поставщиков по ИНН и наименованию победителя
+# и группировки колоночного движка analytics, которые строит Analytics.warm(**ANALYTICS_WARM)
+PARTICIPANTS = 'Участники КС - поставщики'
+WINNER = ('ИНН победителя КС',)
+WINNER_GROUP = ('ИНН победителя КС', 'Наименование победителя КС', 'Регион победителя КС')
+CUSTOMER_NAME = ('Наименование заказчика',)
+SUPPLIER_NAME = ('Наименование победителя КС',)
+END_PRICE = 'Конечная цена КС (победителя в КС)'
+ANALYTICS_WARM = {'counts': (WINNER, WINNER_GROUP, CUSTOMER_NAME), 'sums': ((SUPPLIER_NAME, END_PRICE),),
+                  'labels': WINNER, 'keys': WINNER}
+
+
+def store_path(source):
+    """Каталог хранилища рядом с выгрузкой: data/x.xlsx -> data/x.store"""
+    return os.path.splitext(source)[0] + '.store'
+
+
+def source_version(source):
+    """Версия выгрузки по времени изменения и размеру файла.
+
+    От неё зависят имена файлов хранилища: процессы, конвертирующие одновременно,
+    пишут одинаковые файлы, а не мешают друг другу.
+    """
+    stat = os.stat(source)
+    return f'{stat.st_mtime_ns:x}-{stat.st_size:x}'
+
+
+def read_manifest(store):
+    try:
+        with open(os.path.join(store, MANIFEST), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def is_fresh(source, store):
+    manifest = read_manifest(store)
+    return (manifest is not None and manifest.get('format') == FORMAT
+            and manifest['build'] == source_version(source))
+
+
+def memory_mib(frame):
+    """Объём кадра в памяти с учётом строк (memory_usage(deep=True)), МиБ."""
+    return frame.memory_usage(deep=True).sum() / 2 ** 20
+
+
+def _numeric(column):
+    """Колонка числами или None, если какое-то значение числом не является (тогда она остаётся строковой)."""
+    if column.dtype == object:
+        column = column.astype(str).str.replace(r'\s', '', regex=True).str.replace(',', '.', regex=False) \
+            .where(column.notna())
+    parsed = pd.to_numeric(column, errors='coerce')
+    return parsed if parsed.notna().sum() == column.notna().sum() else None
+
+
+def apply_profile(frame):
+    """Приводит колонки выгрузки к компактным типам профиля (на месте)."""
+    for name in DATE_COLUMNS:
+        if name in frame:
+            frame[name] = pd.to_datetime(frame[name], errors='coerce')
+    for name in INN_COLUMNS + DECIMAL_COLUMNS + COUNT_COLUMNS:
+        column = _numeric(frame[name]) if name in frame else None
+        if column is None or name in INN_COLUMNS and frame[name].astype(str).str.startswith('0').any():
+            continue  # ИНН с ведущими нулями остаются строками
+        has_missing = column.isna().any()
+        if name in INN_COLUMNS and not has_missing:
+            column = column.astype(np.int64)
+        elif name in COUNT_COLUMNS:
+            column = column.astype(np.float32) if has_missing else pd.to_numeric(column, downcast='integer')
+        frame[name] = column
+    return frame
+
+
+def _replace_json(path, data):
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, default=str)
+    os.replace(tmp, path)
+
+
+def _save_array(path, array):
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp, path)
+
+
+def _load_array(path):
+    try:
+        return np.load(path, mmap_mode='r')
+    except ValueError:  # Пустой массив не отображается через mmap
+        return np.load(path)
+
+
+def _save_arrays(store, prefix, arrays):
+    """Сохраняет {имя: массив} файлами prefix-имя.npy; строки - фиксированной ширины (object не отображается)."""
+    files = {}
+    for name, array in arrays.items():
+        array = np.asarray(array)
+        files[name] = f'{prefix}-{name}.npy'
+        _save_array(os.path.join(store, files[name]), array.astype(str) if array.dtype == object else array)
+    return files
+
+
+def _load_arrays(store, files):
+    return {name: _load_array(os.path.join(store, file)) for name, file in files.items()}
+
+
+def build_indexes(frame):
+    """Индексы поверх уже приведённого кадра: {'participants': KeyIndex, 'suppliers': SupplierIndex,
+    'analytics': Analytics}."""
+    parsed = import_util.parse_participants(frame[PARTICIPANTS])
+    participants = analytics.KeyIndex.from_pairs(parsed['inn'].to_numpy(), frame.index.get_indexer(parsed.index))
+    suppliers = supplier_search.SupplierIndex.from_frame(frame, WINNER[0], SUPPLIER_NAME[0])
+    engine = analytics.Analytics(frame).warm(**ANALYTICS_WARM)
+    return {'participants': participants, 'suppliers': suppliers, 'analytics': engine}
+
+
+def _as_tuple(value):
+    """Ключ memo analytics из JSON: списки обратно в кортежи."""
+    return tuple(_as_tuple(item) for item in value) if isinstance(value, list) else value
+
+
+def encode_strings(column):
+    """Строки колонки в раскладке Arrow large_string: смещения int64 (n + 1), буфер UTF-8 и маска непустых."""
+    valid = column.notna().to_numpy()
+    encoded = [value.encode('utf-8') if present else b'' for value, present in zip(column.astype(str), valid)]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8), valid
+
+
+def strings_column(offsets, data, valid=None):
+    """Колонка строк поверх смещений и буфера UTF-8.
+
+    С pyarrow - ArrowExtensionArray без копирования буферов (mmap делится между процессами),
+    без него строки декодируются в object-колонку процесса.
+    """
+    try:
+        import pyarrow as pa
+    except ImportError:
+        buffer = data.tobytes()
+        values = np.array([buffer[start:stop].decode('utf-8') for start, stop in zip(offsets[:-1], offsets[1:])],
+                          dtype=object)
+        if valid is not None:
+            values[~valid] = None
+        return values
+    bitmap = None if valid is None else pa.py_buffer(np.packbits(valid, bitorder='little'))
+    array = pa.Array.from_buffers(pa.large_string(), len(offsets) - 1,
+                                  [bitmap, pa.py_buffer(offsets), pa.py_buffer(data)])
+    return pd.arrays.ArrowExtensionArray(array)
+
+
+def convert(source, store=None):
+    """Читает выгрузку (.xlsx/.csv) и раскладывает её по колонкам в store.
+
+    Колонки приводятся к типам профиля (apply_profile); числовые и datetime сохраняются как есть,
+    строковые - кодами категорий (.npy) и списком категорий в manifest.json либо смещениями,
+    буфером UTF-8 и маской непустых значений (.npy, encode_strings). Индексы build_indexes
+    сохраняются массивами .npy. Манифест пишется последним.
+    """
+    store = store or store_path(source)
+    os.makedirs(store, exist_ok=True)
+    build = source_version(source)
+    previous = read_manifest(store)
+
+    if source.endswith('.csv'):
+        frame = pd.read_csv(source)
+    else:
+        frame = pd.read_excel(source, sheet_name=0)  # sheet_name=0 для первого листа
+    before = memory_mib(frame)
+    apply_profile(frame)
+
+    columns = []
+    for i, name in enumerate(frame.columns):
+        column = frame[name]
+        entry = {'name': name, 'file': f'{build}-{i}.npy'}
+        if column.dtype == object:
+            text = column.astype(str).where(column.notna())
+            if text.nunique() > CATEGORY_MAX_SHARE * text.notna().sum():
+                offsets, data, valid = encode_strings(text)
+                entry['data'] = f'{build}-{i}.data.npy'
+                _save_array(os.path.join(store, entry['data']), data)
+                if not valid.all():
+                    entry['valid'] = f'{build}-{i}.valid.npy'
+                    _save_array(os.path.join(store, entry['valid']), valid)
+                frame[name] = strings_column(offsets, data, None if valid.all() else valid)
+                array = offsets
+            else:
+                # Коды того же типа, что выберет pandas для Categorical: при загрузке они не копируются
+                categorical = pd.Categorical(text)
+                frame[name] = categorical
+                entry['categories'] = categorical.categories.tolist()
+                array = categorical.codes
+        else:
+            array = column.to_numpy()
+        _save_array(os.path.join(store, entry['file']), array)
+        columns.append(entry)
+    after = memory_mib(frame)
+    print(f"Memory usage: {before:.1f} MiB -> {after:.1f} MiB")
+
+    built = build_indexes(frame)
+    indexes = {name: _save_arrays(store, f'{build}-{name}', built[name].arrays())
+               for name in ('participants', 'suppliers')}
+    indexes['analytics'] = [[key, _save_arrays(store, f'{build}-analytics{i}', arrays)]
+                            for i, (key, arrays) in enumerate(built['analytics'].export())]
+
+    _replace_json(os.path.join(store, MANIFEST), {'source': os.path.basename(source), 'build': build,
+                                                  'format': FORMAT, 'rows': len(frame),
+                                                  'memory_mib': {'source': round(before, 2), 'store': round(after, 2)},
+                                                  'columns': columns, 'indexes': indexes})
+
+    # Файлы прошлой версии: уже открытые через mmap продолжают читаться до закрытия
+    if previous and previous['build'] != build:
+        for name in os.listdir(store):
+            if name.startswith(f"{previous['build']}-"):
+                try:
+                    os.remove(os.path.join(store, name))
+                except OSError:
+                    pass
+    return store
+
+
+def load(store):
+    """DataFrame и индексы (как у build_indexes) поверх файлов хранилища, открытых через mmap
+    (только чтение, без копирования)."""
+    manifest = read_manifest(store)
+    if manifest is None:
+        raise FileNotFoundError(f'нет хранилища {store}')
+    data = {}
+    for entry in manifest['columns']:
+        array = _load_array(os.path.join(store, entry['file']))
+        if 'categories' in entry:
+            data[entry['name']] = pd.Categorical.from_codes(array, categories=entry['categories'])
+        elif 'data' in entry:
+            valid = _load_array(os.path.join(store, entry['valid'])) if 'valid' in entry else None
+            data[entry['name']] = strings_column(array, _load_array(os.path.join(store, entry['data'])), valid)
+        else:
+            data[entry['name']] = array
+    frame = pd.DataFrame(data, copy=False)
+
+    indexes = manifest['indexes']
+    memo = analytics.Analytics.restore([(_as_tuple(key), _load_arrays(store, files))
+                                        for key, files in indexes['analytics']])
+    return frame, {'participants': analytics.KeyIndex(**_load_arrays(store, indexes['participants'])),
+                   'suppliers': supplier_search.SupplierIndex(**_load_arrays(store, indexes['suppliers'])),
+                   'analytics': analytics.Analytics(frame, memo)}
+
+
+def open_dataset(source, store=None):
+    """Загружает выгрузку и её индексы из колоночного хранилища, при необходимости сначала конвертируя её."""
+    store = store or store_path(source)
+    if not is_fresh(source, store):
+        print(f"Converting {source} -> {store}")
+        convert(source, store)
+    return load(store)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Конвертация выгрузки TenderHack в колоночное хранилище для main.py')
+    parser.add_argument('source', nargs='?', default='./data/TenderHack_20250228_1900.xlsx', help='файл выгрузки')
+    parser.add_argument('--store', default=None, help='каталог хранилища (по умолчанию - рядом с выгрузкой, .store)')
+    args = parser.parse_args(argv)
+    print(f"Store written: {convert(args.source, args.store)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+# Пул read-only соединений с SQLite для API (main2.py).
+import asyncio
+import queue
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# Соединений на базу; соответствует числу потоков, одновременно выполняющих запросы
+POOL_SIZE = 8
+# Отображение файла базы в память и размер страничного кэша соединения
+MMAP_SIZE = 256 * 1024 * 1024
+CACHE_SIZE_KIB = 64 * 1024
+
+
+def enable_wal(path):
+    """Переводит базу в WAL, чтобы читатели не блокировались загрузкой. Режим сохраняется в файле."""
+    try:
+        conn = sqlite3.connect(f'file:{path}?mode=rw', uri=True)
+    except sqlite3.OperationalError:
+        return False  # Базы ещё нет - не создаём пустую
+    try:
+        return conn.execute('PRAGMA journal_mode = WAL').fetchone()[0] == 'wal'
+    except sqlite3.OperationalError:
+        return False  # Только для чтения - работаем в текущем режиме
+    finally:
+        conn.close()
+
+
+class ConnectionPool:
+    """Пул соединений только для чтения. Соединения открываются лениво, не больше size штук.
+
+    Соединение выдаётся на время запроса через connection() и затем возвращается в пул.
+    """
+
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue()  # LIFO: чаще используются соединения с тёплым кэшем
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+        enable_wal(path)
+
+    def _connect(self):
+        conn = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True, check_same_thread=False)
+        conn.row_factory = sqlite3.Row  # Позволяет обращаться к столбцам по имени
+        conn.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+        conn.execute(f'PRAGMA cache_size = -{CACHE_SIZE_KIB}')
+        conn.execute('PRAGMA query_only = ON')
+        return conn
+
+    def acquire(self, timeout=None):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                conn = self._connect()
+                self._created += 1
+                return conn
+        return self._idle.get(timeout=timeout)
+
+    def release(self, conn):
+        with self._lock:
+            if self._closed:
+                self._created -= 1
+                conn.close()
+                return
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """Закрывает свободные соединения; занятые закроются при возврате в пул."""
+        with self._lock:
+            self._closed = True
+            while True:
+                try:
+                    conn = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                self._created -= 1
+                conn.close()
+
+
+class AsyncDatabase:
+    """Асинхронный доступ к пулу для async-эндпоинтов.
+
+    Запросы sqlite3 блокирующие, поэтому выполняются в выделенном пуле потоков размером с пул
+    соединений: event loop не простаивает, а потоки не ждут свободного соединения.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self._executor = ThreadPoolExecutor(max_workers=pool.size, thread_name_prefix='sqlite')
+
+    def _call(self, fn, args):
+        with self.pool.connection() as conn:
+            return fn(conn, *args)
+
+    async def run(self, fn, *args):
+        """Выполняет fn(conn, *args) с соединением из пула и возвращает результат."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._call, fn, args)
+
+    async def fetchall(self, sql, params=()):
+        return await self.run(lambda conn: conn.execute(sql, params).fetchall())
+
+    async def fetchone(self, sql, params=()):
+        return await self.run(lambda conn: conn.execute(sql, params).fetchone())
+
+    def close(self):
+        """Останавливает пул потоков; вызывается, когда запросов к этой базе больше нет."""
+        self._executor.shutdown(wait=False)
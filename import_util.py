@@ -1,5 +1,51 @@
-import pandas as pd
+import argparse
+import glob
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
 import sqlite3
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from numbers import Number
+from queue import Empty
+
+import openpyxl
+import pandas as pd
+
+import queries
+import rollups
+
+# Размер пачки строк для executemany при массовой загрузке
+BATCH_SIZE = 50000
+# Размер куска строк при потоковом чтении выгрузки
+CHUNK_SIZE = 20000
+# Сколько строк писатель накапливает в одной транзакции при параллельном импорте
+COMMIT_ROWS = 500000
+# Как часто писатель, ожидая кадры, проверяет, не упали ли процессы разбора (секунды)
+QUEUE_POLL_SECONDS = 1.0
+# Расширения файлов, которые понимает iter_chunks
+SUPPORTED_EXTENSIONS = ('.xlsx', '.csv', '.parquet')
+
+# Порядок записи таблиц: сначала справочники, потом ссылающиеся на них таблицы
+TABLE_COLUMNS = {
+    'firma': ['inn', 'firma_name', 'firma_region'],
+    'kpgz': ['kpgz_code', 'kpgz_name'],
+    'ks': ['ks_id', 'ks_url', 'customer_inn', 'winner_inn', 'fz', 'start_time', 'end_time', 'start_price',
+           'end_price', 'kpgz_code', 'offer_start_date', 'offer_end_date'],
+    'participant': ['inn', 'ks_id'],
+    'sku': ['ks_id', 'sku_link', 'sku_name', 'sku_count', 'sku_start_price', 'sku_offer_price'],
+}
+
+# Ключи для UPSERT при инкрементальной загрузке; participant и sku пересобираются целиком по ks_id
+UPSERT_KEYS = {
+    'firma': 'inn',
+    'kpgz': 'kpgz_code',
+    'ks': 'ks_id',
+}
 
 def create_tables(conn):
     cursor = conn.cursor()
@@ -61,7 +107,177 @@ def create_tables(conn):
         )
     ''')
 
+    # Метаданные загрузок: контрольные суммы файлов, high-water mark, версия данных
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS import_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+
+    rollups.create_rollup_tables(conn)
+    conn.commit()
+
+
+def create_indexes(conn):
+    """Миграция схемы: индексы под запросы main2.py и обновление статистики планировщика.
+
+    participant.inn покрыт первичным ключом (inn, ks_id), поэтому отдельного индекса не требует.
+    """
+    cursor = conn.cursor()
+    # /wins_dots: покрывающий индекс, выборка побед целиком без обращения к таблице
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_ks_winner
+        ON ks (winner_inn, end_time, start_price, end_price)
+    ''')
+    # Страницы /sessions с фильтром идут по индексу в порядке ks_id, без сортировки: ks_id - rowid, и индекс
+    # по одной колонке уже неявно упорядочен (колонка, ks_id); idx_ks_winner для этого не подходит
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ks_winner_page ON ks (winner_inn, ks_id)')
+    # /inns?region=: фирмы региона по возрастанию ИНН (inn - не rowid, поэтому в индексе явно)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_firma_region ON firma (firma_region, inn)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ks_customer ON ks (customer_inn)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ks_kpgz ON ks (kpgz_code)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ks_end_time ON ks (end_time)')
+    # /competitors, /contracts_by_years: соседи по КС через participant.ks_id
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_participant_ks ON participant (ks_id, inn)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sku_ks ON sku (ks_id)')
+    conn.commit()
+    cursor.execute('ANALYZE')
+    conn.commit()
+
+
+# Типизированные колонки сырой таблицы data (tender.db): цены числом, время - unix epoch.
+# Заполняются один раз при загрузке/миграции, чтобы фильтры /customers/config/ шли по индексам,
+# а не чистили строки CAST(TRIM(REPLACE(...))) в каждой строке на каждый запрос.
+RAW_TYPED_COLUMNS = {
+    'start_price_num': ('REAL', queries.START_PRICE),
+    'end_price_num': ('REAL', queries.END_PRICE),
+    'start_ts': ('INTEGER', '''CAST(strftime('%s', data."Начало КС") AS INTEGER)'''),
+    'end_ts': ('INTEGER', '''CAST(strftime('%s', data."Окончание КС") AS INTEGER)'''),
+}
+
+RAW_INDEXES = {
+    'idx_data_end_price': 'end_price_num',
+    'idx_data_end_ts': 'end_ts',
+    'idx_data_ks': '"Id КС"',
+    'idx_data_kpgz': '"Код КПГЗ"',
+    'idx_data_customer': '"ИНН заказчика"',
+    'idx_data_winner': '"ИНН победителя КС"',
+    'idx_data_winner_region': '"Регион победителя КС"',
+}
+
+
+def migrate_raw_data(conn):
+    """Миграция tender.db: добавляет и заполняет типизированные колонки data, строит индексы.
+
+    Повторный запуск безопасен: заполняются только строки, где колонки ещё пусты (например, дозагруженные).
+    """
+    existing = {row[1] for row in conn.execute('PRAGMA table_info(data)')}
+    if not existing:
+        return
+    for column, (column_type, _) in RAW_TYPED_COLUMNS.items():
+        if column not in existing:
+            conn.execute(f'ALTER TABLE data ADD COLUMN {column} {column_type}')
+    assignments = ', '.join(f'{column} = {expression}' for column, (_, expression) in RAW_TYPED_COLUMNS.items())
+    pending = ' OR '.join(f'{column} IS NULL' for column in RAW_TYPED_COLUMNS)
+    conn.execute(f'UPDATE data SET {assignments} WHERE {pending}')
+    for name, column in RAW_INDEXES.items():
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON data ({column})')
+    conn.commit()
+    build_raw_participants(conn)
+    conn.execute('ANALYZE data')
+    conn.execute('ANALYZE data_participant')
+    conn.commit()
+
+
+def build_raw_participants(conn, chunk_size=CHUNK_SIZE):
+    """Индекс участников для tender.db: data_participant (inn, ks_id), разобранный как в insert_data.
+
+    Даёт точный поиск "КС, где участвовал ИНН" вместо LIKE по строке участников.
+    Разбираются только КС, которых нет в data_participant_parsed (в том числе КС без участников);
+    КС, загруженные заново, удаляются из обеих таблиц (drop_raw_sessions) и разбираются снова.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS data_participant (
+            inn TEXT,
+            ks_id INTEGER,
+            PRIMARY KEY (inn, ks_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_data_participant_ks ON data_participant (ks_id)')
+    # КС, чьи участники уже разобраны
+    conn.execute('CREATE TABLE IF NOT EXISTS data_participant_parsed (ks_id INTEGER PRIMARY KEY)')
+    pending = pd.read_sql_query('''
+        SELECT data."Id КС" AS ks_id, data."Участники КС - поставщики" AS participants
+        FROM data
+        WHERE data."Id КС" NOT IN (SELECT ks_id FROM data_participant_parsed)
+        GROUP BY data."Id КС"
+    ''', conn, chunksize=chunk_size)
+    for chunk in pending:
+        parsed = parse_participants(chunk['participants'])
+        parsed['ks_id'] = chunk['ks_id'].loc[parsed.index].astype(int)
+        conn.executemany('INSERT OR IGNORE INTO data_participant (inn, ks_id) VALUES (?, ?)',
+                         parsed[['inn', 'ks_id']].itertuples(index=False, name=None))
+        conn.executemany('INSERT OR IGNORE INTO data_participant_parsed (ks_id) VALUES (?)',
+                         ((int(ks_id),) for ks_id in chunk['ks_id'].dropna()))
+    conn.commit()
+
+
+def drop_raw_sessions(conn, ks_ids):
+    """Удаляет из data и data_participant строки КС, которые загружаются заново (их участники разберутся снова)."""
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    ids = json.dumps(sorted(ks_ids))
+    if 'data' in tables:
+        conn.execute('DELETE FROM data WHERE "Id КС" IN (SELECT value FROM json_each(?))', (ids,))
+    for table in ('data_participant', 'data_participant_parsed'):
+        if table in tables:
+            conn.execute(f'DELETE FROM {table} WHERE ks_id IN (SELECT value FROM json_each(?))', (ids,))
+
+
+def insert_raw_data(conn, path, chunk_size=CHUNK_SIZE):
+    """Потоково загружает выгрузку как есть в таблицу data (tender.db) и заполняет типизированные колонки.
+
+    Прежние строки КС из выгрузки удаляются: data остаётся точной копией последних выгрузок.
+    """
+    rows = 0
+    started = time.perf_counter()
+    loaded = set()
+    for chunk in iter_chunks(path, chunk_size):
+        # Строки одной КС могут прийти в разных кусках: удаляются только КС, ещё не записанные из этого файла
+        ks_ids = set(pd.to_numeric(chunk['Id КС'], errors='coerce').dropna().astype(int)) - loaded
+        if ks_ids:
+            drop_raw_sessions(conn, ks_ids)
+            loaded |= ks_ids
+        chunk.to_sql('data', conn, if_exists='append', index=False)
+        rows += len(chunk)
     conn.commit()
+    migrate_raw_data(conn)
+    report_stats({'data': (rows, time.perf_counter() - started)})
+
+
+def full_scans(conn, sql, params):
+    """Возвращает строки EXPLAIN QUERY PLAN, означающие полный просмотр таблицы.
+
+    Любой SCAN таблицы - в том числе SCAN ... USING [COVERING] INDEX, обход всего индекса.
+    Законны только SEARCH, просмотр подзапросов и виртуальных таблиц (json_each).
+    """
+    plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+    # Подзапросы (CO-ROUTINE X / MATERIALIZE X) просматриваются целиком законно
+    subqueries = {detail.split()[-1] for detail in plan if detail.startswith(('CO-ROUTINE', 'MATERIALIZE'))}
+    return [detail for detail in plan
+            if detail.startswith('SCAN ') and 'VIRTUAL TABLE' not in detail
+            and detail.split()[1] not in subqueries and detail != 'SCAN CONSTANT ROW']
+
+
+def check_query_plans(conn, endpoint_queries=None):
+    """Проверка: ни один запрос эндпоинтов не должен полностью сканировать таблицы."""
+    problems = []
+    for endpoint, (sql, params) in (endpoint_queries or queries.ENDPOINT_QUERIES).items():
+        problems.extend(f"{endpoint}: {detail}" for detail in full_scans(conn, sql, params))
+    if problems:
+        raise RuntimeError("Полный просмотр таблиц в планах запросов:\n" + "\n".join(problems))
+    print(f"Планы запросов в порядке: {len(endpoint_queries or queries.ENDPOINT_QUERIES)}")
+
 
 def insert_data(conn, excel_file):
     df = pd.read_excel(excel_file)
@@ -166,65 +382,563 @@ def insert_data(conn, excel_file):
 
     conn.commit()
 
-@app.get("/competitors")
-async def get_competitors(inn: str = Query(...)):
-    conn = get_db_connection()
+def parse_participants(participants):
+    """Разбор колонки "Участники КС - поставщики" (та же логика, что в insert_data).
+
+    Возвращает DataFrame с колонками inn, firma_name, firma_region; индекс - индекс исходной строки.
+    """
+    parts = participants.astype(str).str.split('; ').explode().str.split('  ')  # Разделяем по двум пробелам
+    parts = parts[parts.str.len() >= 3]
+    return pd.DataFrame({
+        'inn': parts.str[0].str.replace('ИНН:', '').str.strip(),
+        'firma_name': parts.str[1].str.strip(),
+        'firma_region': parts.str[2].str.strip(),
+    }, index=parts.index)
+
+
+def _clean_price(column):
+    return column.astype(str).str.replace(' ', '').str.replace(',', '.').astype(float)
+
+
+def _inn_text(column):
+    """ИНН строками независимо от типа, который pandas вывел для куска.
+
+    Кусок с пропуском ИНН читается как float, и astype(str) дал бы '7700000057.0' вместо '7700000057'.
+    """
+    if column.dtype.kind == 'f':
+        text = column.astype(str)
+        integral = column.notna() & (column % 1 == 0)
+        text[integral] = column[integral].astype('int64').astype(str)
+        return text
+    if column.dtype == object:
+        return column.map(lambda value: str(int(value)) if isinstance(value, float) and value.is_integer()
+                          else str(value))
+    return column.astype(str)
+
+
+def build_frames(df):
+    """Векторизованно строит кадры firma, kpgz, ks, participant и sku из выгрузки TenderHack."""
+    customer_inn = _inn_text(df['ИНН заказчика'])
+    winner_inn = _inn_text(df['ИНН победителя КС'])
+    ks_id = df['Id КС'].astype(int)
+    kpgz_code = df['Код КПГЗ'].astype(str)
+
+    participants = parse_participants(df['Участники КС - поставщики'])
+    participants['ks_id'] = ks_id.loc[participants.index]
+
+    firma = pd.concat([
+        pd.DataFrame({'inn': customer_inn, 'firma_name': df['Наименование заказчика'],
+                      'firma_region': df['Регион заказчика']}),
+        pd.DataFrame({'inn': winner_inn, 'firma_name': df['Наименование победителя КС'],
+                      'firma_region': df['Регион победителя КС']}),
+        participants[['inn', 'firma_name', 'firma_region']],
+    ], ignore_index=True).drop_duplicates('inn')
+
+    ks = pd.DataFrame({
+        'ks_id': ks_id,
+        'ks_url': df['Ссылка на КС'],
+        'customer_inn': customer_inn,
+        'winner_inn': winner_inn,
+        'fz': df['Закон-основание'],
+        'start_time': df['Начало КС'].astype(str),
+        'end_time': df['Окончание КС'].astype(str),
+        'start_price': df['Начальная цена КС'].astype(float),
+        'end_price': df['Конечная цена КС (победителя в КС)'].astype(float),
+        'kpgz_code': kpgz_code,
+        'offer_start_date': df['Начало действия оферты'].astype(str),
+        'offer_end_date': df['Окончание действия оферты'].astype(str),
+    }).drop_duplicates('ks_id')
+
+    kpgz = pd.DataFrame({'kpgz_code': kpgz_code, 'kpgz_name': df['Наименование КПГЗ']}).drop_duplicates('kpgz_code')
+
+    sku = pd.DataFrame({
+        'ks_id': ks_id,
+        'sku_link': df['Ссылка на СТЕ'],
+        'sku_name': df['Наименование СТЕ'],
+        'sku_count': df['Количество СТЕ'].astype(int),
+        'sku_start_price': _clean_price(df['Стоимость за единицу СТЕ']),
+        'sku_offer_price': _clean_price(df['Цена оферты за единицу']),
+    })
+
+    return {
+        'firma': firma,
+        'kpgz': kpgz,
+        'ks': ks,
+        'participant': participants[['inn', 'ks_id']].drop_duplicates(),
+        'sku': sku,
+    }
+
+
+def _insert_sql(table, columns, upsert):
+    sql = f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    key = UPSERT_KEYS.get(table)
+    if not upsert or key is None:
+        return sql
+    updates = ', '.join(f'{column} = excluded.{column}' for column in columns if column != key)
+    return sql.replace('INSERT OR IGNORE', 'INSERT', 1) + f' ON CONFLICT ({key}) DO UPDATE SET {updates}'
+
+
+def write_frames(conn, frames, batch_size=BATCH_SIZE, upsert=False):
+    """Пишет кадры из build_frames пачками через executemany (INSERT OR IGNORE).
+
+    С upsert=True справочники и ks обновляются через ON CONFLICT DO UPDATE.
+    Транзакцией управляет вызывающий код. Возвращает {таблица: (строк, секунд)}.
+    """
     cursor = conn.cursor()
+    stats = {}
+    for table, columns in TABLE_COLUMNS.items():
+        frame = frames[table]
+        sql = _insert_sql(table, columns, upsert)
+        rows = frame[columns].itertuples(index=False, name=None)
+        started = time.perf_counter()
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            cursor.executemany(sql, batch)
+        stats[table] = (len(frame), time.perf_counter() - started)
+    return stats
+
+
+def merge_stats(total, stats):
+    for table, (rows, seconds) in stats.items():
+        prev_rows, prev_seconds = total.get(table, (0, 0.0))
+        total[table] = (prev_rows + rows, prev_seconds + seconds)
+    return total
+
+
+def report_stats(stats):
+    for table, (rows, seconds) in stats.items():
+        rate = rows / seconds if seconds > 0 else float('inf')
+        print(f"{table}: {rows} строк за {seconds:.2f} с ({rate:.0f} строк/с)")
+
+
+def get_meta(conn, key, default=None):
+    row = conn.execute('SELECT value FROM import_meta WHERE key = ?', (key,)).fetchone()
+    return row[0] if row else default
+
+
+def set_meta(conn, key, value):
+    conn.execute('INSERT OR REPLACE INTO import_meta (key, value) VALUES (?, ?)', (key, str(value)))
+
+
+def bump_data_version(conn):
+    """Увеличивает версию данных; вызывается в конце каждой загрузки, меняющей БД."""
+    version = int(get_meta(conn, 'data_version', 0)) + 1
+    set_meta(conn, 'data_version', version)
+    return version
+
+
+def finish_import(conn, incremental=False):
+    """Завершение загрузки: пересчёт агрегатов (целиком или только отмеченных) и новая версия данных."""
+    started = time.perf_counter()
+    rollups.refresh_rollups(conn, incremental)
+    print(f"Агрегаты пересчитаны за {time.perf_counter() - started:.2f} с")
+    return bump_data_version(conn)
+
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def insert_data_bulk(conn, excel_file, batch_size=BATCH_SIZE):
+    """Массовая загрузка: векторный разбор выгрузки и запись всех таблиц одной транзакцией."""
+    df = pd.read_excel(excel_file)
+    frames = build_frames(df)
+    try:
+        stats = write_frames(conn, frames, batch_size)
+        finish_import(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    report_stats(stats)
+    return stats
+
+
+def iter_chunks(path, chunk_size=CHUNK_SIZE):
+    """Потоково читает выгрузку кусками по chunk_size строк, не загружая файл целиком.
+
+    xlsx читается через openpyxl в режиме read_only, csv - через pandas chunksize,
+    parquet - по row group'ам через pyarrow (если установлен).
+    """
+    lower = str(path).lower()
+    if lower.endswith('.csv'):
+        yield from pd.read_csv(path, chunksize=chunk_size)
+        return
+    if lower.endswith('.parquet'):
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+        return
+
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        while True:
+            batch = list(itertools.islice(rows, chunk_size))
+            if not batch:
+                break
+            yield pd.DataFrame(batch, columns=header)
+    finally:
+        workbook.close()
+
+
+def insert_data_streaming(conn, path, chunk_size=CHUNK_SIZE, batch_size=BATCH_SIZE):
+    """Потоковая загрузка: выгрузка разбирается кусками фиксированного размера и сразу пишется в SQLite.
+
+    Пиковая память определяется chunk_size, а не размером файла. Дубликаты между кусками
+    отсекает INSERT OR IGNORE. Всё пишется одной транзакцией.
+    """
+    total = {}
+    try:
+        for chunk in iter_chunks(path, chunk_size):
+            merge_stats(total, write_frames(conn, build_frames(chunk), batch_size))
+        finish_import(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    report_stats(total)
+    return total
+
+
+def _max_end_time(end_times, current=None):
+    parsed = pd.to_datetime(pd.Series(end_times), errors='coerce').dropna()
+    if current is not None:
+        parsed = pd.concat([parsed, pd.Series([pd.Timestamp(current)])])
+    return str(parsed.max()) if not parsed.empty else current
+
+
+def _row_key(row):
+    """Строка participant / sku в виде, сравнимом между кадром и БД (NaN -> None, числа -> float)."""
+    return tuple(None if pd.isna(value) else float(value) if isinstance(value, Number) else str(value)
+                 for value in row)
+
+
+def _children_changed(conn, frames, ks_ids):
+    """КС из ks_ids, у которых набор participant или строк sku в кадрах отличается от записанного в БД."""
+    ids = json.dumps(sorted(ks_ids))
+    changed = set()
+    for table in ('participant', 'sku'):
+        columns = ['ks_id'] + [column for column in TABLE_COLUMNS[table] if column != 'ks_id']
+        stored = conn.execute(
+            f"SELECT {', '.join(columns)} FROM {table} WHERE ks_id IN (SELECT value FROM json_each(?))", (ids,))
+        frame = frames[table]
+        incoming = frame.loc[frame['ks_id'].isin(ks_ids), columns].itertuples(index=False, name=None)
+        old = Counter(_row_key(row) for row in stored)
+        new = Counter(_row_key(row) for row in incoming)
+        changed |= {int(key[0]) for key in (old - new) | (new - old)}
+    return changed
+
+
+def select_delta(conn, frames, high_water_mark, seen):
+    """Оставляет в кадрах только новые и изменённые КС.
+
+    seen - {ks_id: записана ли КС} по уже разобранным в этой загрузке кускам: по ним решение
+    не пересматривается, их строки из следующих кусков попадают в дельту (см. write_delta).
+    Остальная КС попадает в дельту, если её нет в БД, если отличаются поля ks, участники
+    или строки sku, или если она закончилась не раньше high-water mark (ещё могла меняться).
+    """
+    ks = frames['ks']
+    decided = {ks_id for ks_id in ks['ks_id'] if ks_id in seen}
+    ks = ks[~ks['ks_id'].isin(decided)]
+    existing = pd.read_sql_query(
+        f"SELECT {', '.join(TABLE_COLUMNS['ks'])} FROM ks WHERE ks_id IN (SELECT value FROM json_each(?))",
+        conn, params=(json.dumps(ks['ks_id'].tolist()),))
+    merged = ks.merge(existing, on='ks_id', how='left', suffixes=('', '_db'), indicator=True)
+
+    delta = merged['_merge'] == 'left_only'
+    for column in TABLE_COLUMNS['ks'][1:]:
+        new, old = merged[column], merged[f'{column}_db']
+        delta |= (new != old) & ~(new.isna() & old.isna())
+    if high_water_mark is not None:
+        delta |= pd.to_datetime(merged['end_time'], errors='coerce') >= pd.Timestamp(high_water_mark)
+
+    ks_ids = set(merged.loc[delta.to_numpy(), 'ks_id'])
+    ks_ids |= _children_changed(conn, frames, set(merged['ks_id']) - ks_ids) | decided
+    result = {table: frame[frame['ks_id'].isin(ks_ids)] for table, frame in frames.items() if 'ks_id' in frame}
+    participant_inns = set(result['participant']['inn'])
+    session_inns = participant_inns | set(result['ks']['customer_inn']) | set(result['ks']['winner_inn'])
+    result['firma'] = frames['firma'][frames['firma']['inn'].isin(session_inns)]
+    result['kpgz'] = frames['kpgz'][frames['kpgz']['kpgz_code'].isin(set(result['ks']['kpgz_code']))]
+    return result
+
+
+def replace_session_children(conn, ks_ids):
+    """Удаляет participant и sku для КС, которые будут записаны заново."""
+    ids = json.dumps(sorted(ks_ids))
+    conn.execute('DELETE FROM participant WHERE ks_id IN (SELECT value FROM json_each(?))', (ids,))
+    conn.execute('DELETE FROM sku WHERE ks_id IN (SELECT value FROM json_each(?))', (ids,))
+
+
+def write_delta(conn, frames, high_water_mark, seen, batch_size=BATCH_SIZE):
+    """Пишет дельту одного куска через upsert.
+
+    Решение по КС принимается один раз за загрузку, в первом куске с её строками, и сохраняется
+    в seen ({ks_id: записана ли КС}). У КС, решённой впервые, participant и sku пересобираются;
+    строки уже записанной КС из следующих кусков дописываются. Если строки КС, признанной
+    неизменной, встретились снова, в БД было меньше строк, чем в выгрузке: КС становится
+    записанной, и новые строки дописываются к совпавшим. Затронутые агрегаты (по состоянию КС
+    до и после обновления) отмечаются в БД через rollups.mark_sessions.
+    """
+    undecided = {ks_id for ks_id in frames['ks']['ks_id'] if ks_id not in seen}
+    delta = select_delta(conn, frames, high_water_mark, seen)
+    written = set(delta['ks']['ks_id'])
+    fresh = written & undecided
+    seen.update(dict.fromkeys(undecided, False))
+    seen.update(dict.fromkeys(written, True))
+    # Как и при полной загрузке, для КС побеждает первая встреченная строка
+    delta['ks'] = delta['ks'][delta['ks']['ks_id'].isin(fresh)]
+    if not written:
+        return {}
+    rollups.mark_sessions(conn, written)
+    replace_session_children(conn, fresh)
+    stats = write_frames(conn, delta, batch_size, upsert=True)
+    rollups.mark_sessions(conn, written)
+    return stats
+
+
+def insert_data_incremental(conn, path, chunk_size=CHUNK_SIZE, batch_size=BATCH_SIZE):
+    """Инкрементальная загрузка: в ks, participant и sku upsert'ятся только новые и изменённые КС.
+
+    Неизменившийся файл (по sha256) пропускается целиком. После загрузки в import_meta
+    записываются контрольная сумма файла и high-water mark (максимальное end_time).
+    """
+    checksum_key = f'checksum:{os.path.basename(path)}'
+    checksum = file_checksum(path)
+    if get_meta(conn, checksum_key) == checksum:
+        print(f"{path}: файл не изменился, загрузка пропущена")
+        return {}
+
+    high_water_mark = get_meta(conn, 'high_water_mark')
+    new_high_water_mark = high_water_mark
+    seen = {}
+    total = {}
+    try:
+        for chunk in iter_chunks(path, chunk_size):
+            frames = build_frames(chunk)
+            new_high_water_mark = _max_end_time(frames['ks']['end_time'], new_high_water_mark)
+            merge_stats(total, write_delta(conn, frames, high_water_mark, seen, batch_size))
+
+        set_meta(conn, checksum_key, checksum)
+        if new_high_water_mark is not None:
+            set_meta(conn, 'high_water_mark', new_high_water_mark)
+        if rollups.has_pending(conn):
+            finish_import(conn, incremental=True)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    print(f"{path}: обновлено КС: {sum(seen.values())}")
+    report_stats(total)
+    return total
+
+
+def collect_files(patterns):
+    """Раскрывает каталоги и glob-шаблоны в отсортированный список файлов выгрузок."""
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = glob.glob(os.path.join(pattern, '*'))
+        else:
+            matches = glob.glob(pattern)
+        files.extend(sorted(path for path in matches if path.lower().endswith(SUPPORTED_EXTENSIONS)))
+    return list(dict.fromkeys(files))
+
+
+def claim_sessions(conn, frames, rank, owners):
+    """Правило пересечения файлов параллельного импорта: КС достаётся файлу с наибольшим rank.
+
+    owners - {ks_id: rank файла, из которого КС записана в этой загрузке}. Из кадров убираются КС,
+    уже записанные из файла с большим rank; КС, записанные из файла с меньшим rank, удаляются из БД
+    вместе с participant и sku, чтобы записаться заново. Возвращает кадры и ks_id удалённых КС.
+    """
+    ks_ids = set(frames['ks']['ks_id'])
+    taken = {ks_id for ks_id in ks_ids if owners.get(ks_id, rank) > rank}
+    lost = {ks_id for ks_id in ks_ids if owners.get(ks_id, rank) < rank}
+    if taken:
+        frames = {table: frame[~frame['ks_id'].isin(taken)] if 'ks_id' in frame else frame
+                  for table, frame in frames.items()}
+    if lost:
+        rollups.mark_sessions(conn, lost)
+        replace_session_children(conn, lost)
+        conn.execute('DELETE FROM ks WHERE ks_id IN (SELECT value FROM json_each(?))', (json.dumps(sorted(lost)),))
+    owners.update(dict.fromkeys(ks_ids - taken, rank))
+    return frames, lost
+
+
+def _parse_file(path, chunk_size, queue):
+    """Рабочий процесс: разбирает файл кусками и отдаёт готовые кадры писателю через очередь.
+
+    В конце всегда отправляет (path, None, ошибка или None) как признак завершения файла.
+    """
+    try:
+        for chunk in iter_chunks(path, chunk_size):
+            queue.put((path, build_frames(chunk), None))
+    except Exception as e:
+        queue.put((path, None, repr(e)))
+    else:
+        queue.put((path, None, None))
+
+
+def changed_files(conn, paths):
+    """Файлы, изменившиеся с прошлой загрузки (sha256 в import_meta): {путь: контрольная сумма}."""
+    checksums = {}
+    for path in paths:
+        checksum = file_checksum(path)
+        if get_meta(conn, f'checksum:{os.path.basename(path)}') == checksum:
+            print(f"{path}: файл не изменился, загрузка пропущена")
+        else:
+            checksums[path] = checksum
+    return checksums
+
+
+def import_files(conn, paths, workers=None, chunk_size=CHUNK_SIZE, batch_size=BATCH_SIZE, incremental=False,
+                 commit_rows=COMMIT_ROWS, checksums=None):
+    """Параллельный импорт нескольких выгрузок.
+
+    Файлы разбираются в пуле процессов (чтение и разбор участников упираются в CPU),
+    готовые кадры через ограниченную очередь идут единственному писателю - текущему процессу,
+    который коммитит в SQLite крупными транзакциями по commit_rows строк.
+    Если одна КС встречается в нескольких файлах, в обоих режимах остаётся её версия из файла,
+    стоящего в paths позже (более свежей выгрузки), независимо от порядка разбора (claim_sessions).
+    checksums - уже посчитанный changed_files(conn, paths) для инкрементальной загрузки.
+    """
+    workers = workers or os.cpu_count() or 1
+    if not incremental:
+        checksums = {}
+    elif checksums is None:
+        checksums = changed_files(conn, paths)
+    if incremental:
+        paths = list(checksums)
+    if not paths:
+        return {}
+
+    high_water_mark = get_meta(conn, 'high_water_mark') if incremental else None
+    new_high_water_mark = high_water_mark
+    ranks = {path: rank for rank, path in enumerate(paths)}
+    owners = {}
+    seen = {}
+    total = {}
+    pending_rows = 0
+    started = time.perf_counter()
+    # Менеджер закрывается первым: при ошибке писателя рабочие, ждущие места в очереди, не зависнут
+    with ProcessPoolExecutor(max_workers=workers) as pool, multiprocessing.Manager() as manager:
+        queue = manager.Queue(maxsize=2 * workers)
+        futures = {pool.submit(_parse_file, path, chunk_size, queue): path for path in paths}
+        remaining = len(paths)
+        try:
+            while remaining:
+                try:
+                    path, frames, error = queue.get(timeout=QUEUE_POLL_SECONDS)
+                except Empty:
+                    # Процесс, убитый целиком (OOM, сигнал), не успевает отправить признак завершения
+                    for future, path in futures.items():
+                        if future.done() and future.exception() is not None:
+                            raise RuntimeError(f"{path}: {future.exception()!r}")
+                    continue
+                if frames is None:
+                    remaining -= 1
+                    if error is not None:
+                        raise RuntimeError(f"{path}: {error}")
+                    print(f"{path}: разобран")
+                    continue
+                frames, lost = claim_sessions(conn, frames, ranks[path], owners)
+                if incremental:
+                    # КС, удалённые claim_sessions, пишутся заново как новые
+                    for ks_id in lost:
+                        seen.pop(ks_id, None)
+                    new_high_water_mark = _max_end_time(frames['ks']['end_time'], new_high_water_mark)
+                    stats = write_delta(conn, frames, high_water_mark, seen, batch_size)
+                else:
+                    stats = write_frames(conn, frames, batch_size)
+                merge_stats(total, stats)
+                pending_rows += sum(rows for rows, _ in stats.values())
+                if pending_rows >= commit_rows:
+                    conn.commit()
+                    pending_rows = 0
+
+            for path, checksum in checksums.items():
+                set_meta(conn, f'checksum:{os.path.basename(path)}', checksum)
+            if new_high_water_mark is not None:
+                set_meta(conn, 'high_water_mark', new_high_water_mark)
+            if not incremental:
+                finish_import(conn)
+            elif rollups.has_pending(conn):
+                # В том числе отметки загрузки, прерванной после промежуточного коммита
+                finish_import(conn, incremental=True)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    print(f"Файлов: {len(paths)}, процессов: {workers}, всего {time.perf_counter() - started:.2f} с")
+    report_stats(total)
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Загрузка выгрузок TenderHack в SQLite')
+    parser.add_argument('paths', nargs='*', default=[r'.\data\TenderHack_20250228_1900.xlsx'],
+                        help='файлы, каталоги или glob-шаблоны (например data/TenderHack_*.xlsx)')
+    parser.add_argument('--db', default='Tender7.db', help='файл базы SQLite')
+    parser.add_argument('--workers', type=int, default=None, help='число процессов разбора (по умолчанию - по ядрам)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='строк в одном куске')
+    parser.add_argument('--incremental', action='store_true', help='загружать только новые и изменённые КС')
+    parser.add_argument('--raw-db', default=None,
+                        help='также загрузить выгрузки как есть в таблицу data этой базы (tender.db)')
+    parser.add_argument('--migrate-only', action='store_true', help='только миграции, индексы и ANALYZE, без загрузки')
+    parser.add_argument('--check-plans', action='store_true',
+                        help='после миграции проверить, что запросы эндпоинтов не сканируют таблицы целиком')
+    args = parser.parse_args(argv)
+
+    files = [] if args.migrate_only else collect_files(args.paths)
+    if not files and not args.migrate_only:
+        parser.error('не найдено ни одного файла выгрузки')
+
+    conn = sqlite3.connect(args.db)
+    try:
+        create_tables(conn)
+        checksums = None
+        if files and args.incremental:
+            # Неизменившиеся файлы пропускаются и нормализованной загрузкой, и загрузкой в --raw-db
+            checksums = changed_files(conn, files)
+            files = list(checksums)
+        if files:
+            import_files(conn, files, workers=args.workers, chunk_size=args.chunk_size, incremental=args.incremental,
+                         checksums=checksums)
+        elif rollups.is_missing(conn):
+            # База загружена до появления агрегатов: строим их все по уже загруженным КС
+            rollups.refresh_rollups(conn)
+            bump_data_version(conn)
+            conn.commit()
+        create_indexes(conn)
+        if args.check_plans:
+            try:
+                check_query_plans(conn)
+            except RuntimeError as e:
+                sys.exit(str(e))
+    finally:
+        conn.close()
+
+    if args.raw_db:
+        raw_conn = sqlite3.connect(args.raw_db)
+        try:
+            for path in files:
+                insert_raw_data(raw_conn, path, args.chunk_size)
+            migrate_raw_data(raw_conn)
+        finally:
+            raw_conn.close()
+    print("Data transferred successfully!")
 
-    # Запрос для получения списка конкурентов
-    cursor.execute('''
-        SELECT 
-            p2.inn AS competitor_inn,
-            f2.firma_name AS competitor_name,
-            f2.firma_region AS competitor_region,
-            COUNT(DISTINCT ks.ks_id) AS total_contracts,
-            SUM(CASE WHEN p2.inn = ks.winner_inn THEN 1 ELSE 0 END) AS competitor_wins,
-            SUM(CASE WHEN p1.inn = ks.winner_inn THEN 1 ELSE 0 END) AS supplier_wins
-        FROM 
-            participant p1
-        JOIN 
-            participant p2 ON p1.ks_id = p2.ks_id AND p1.inn != p2.inn
-        JOIN 
-            ks ON p1.ks_id = ks.ks_id
-        JOIN 
-            firma f2 ON p2.inn = f2.inn
-        WHERE 
-            p1.inn = ?
-        GROUP BY 
-            p2.inn, f2.firma_name, f2.firma_region
-    ''', (inn,))
-
-    results = cursor.fetchall()
-
-    # Обработка результатов
-    competitors = []
-    for row in results:
-        total_contracts = row['total_contracts']
-        competitor_wins = row['competitor_wins']
-        supplier_wins = row['supplier_wins']
-
-        competitor_percentage = (competitor_wins / total_contracts * 100) if total_contracts > 0 else 0
-        supplier_percentage = (supplier_wins / total_contracts * 100) if total_contracts > 0 else 0
-
-        competitors.append({
-            "competitor_inn": row['competitor_inn'],
-            "competitor_name": row['competitor_name'],
-            "competitor_region": row['competitor_region'],
-            "total_contracts": total_contracts,
-            "competitor_wins": competitor_wins,
-            "competitor_win_percentage": round(competitor_percentage, 2),
-            "supplier_wins": supplier_wins,
-            "supplier_win_percentage": round(supplier_percentage, 2)
-        })
-
-    return JSONResponse(content={"competitors": competitors})
 
 if __name__ == '__main__':
-    db_file = 'Tender7.db'
-    excel_file = r'.\data\TenderHack_20250228_1900.xlsx'
-
-    conn = sqlite3.connect(db_file)
-    create_tables(conn)
-    insert_data(conn, excel_file)
-    conn.close()
-    print("Data transferred successfully!")
\ No newline at end of file
+    main()
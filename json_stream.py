@@ -0,0 +1,86 @@
+# Потоковая отдача больших выборок: строки кодируются в JSON по мере чтения из курсора,
+# поэтому память на запрос не зависит от размера результата.
+# Если установлен orjson, кодирование идёт через него (в разы быстрее json).
+import json
+
+from fastapi.responses import StreamingResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Сколько строк читать из курсора и кодировать за один кусок ответа
+FETCH_SIZE = 1000
+
+FORMATS = ('json', 'ndjson')
+FORMAT_PATTERN = '^(json|ndjson)$'
+
+
+def _default(value):
+    if hasattr(value, 'isoformat'):
+        return None if value != value else str(value)  # Timestamp, date; NaT -> null
+    if hasattr(value, 'item'):
+        return value.item()  # Скаляры numpy
+    raise TypeError(f'Type is not JSON serializable: {type(value).__name__}')
+
+
+def dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, ensure_ascii=False, default=_default).encode()
+
+
+def _batches(rows, size=FETCH_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_ndjson(rows, tail=None):
+    """По строке JSON на запись; tail() - необязательная итоговая запись в конце."""
+    for batch in _batches(rows):
+        yield b''.join(dumps(row) + b'\n' for row in batch)
+    if tail is not None:
+        yield dumps(tail()) + b'\n'
+
+
+def iter_json(rows, key=None, tail=None):
+    """JSON-массив кусками. С key - объект {key: [...], **tail()}, tail() вычисляется после строк."""
+    yield b'[' if key is None else b'{' + dumps(key) + b':['
+    first = True
+    for batch in _batches(rows):
+        chunk = b','.join(dumps(row) for row in batch)
+        yield chunk if first else b',' + chunk
+        first = False
+    if key is None:
+        yield b']'
+        return
+    extra = tail() if tail is not None else {}
+    yield b']' + b''.join(b',' + dumps(name) + b':' + dumps(value) for name, value in extra.items()) + b'}'
+
+
+def pooled_rows(pool, sql, params=(), convert=dict):
+    """Читает результат запроса кусками по FETCH_SIZE, удерживая соединение пула до конца чтения."""
+    with pool.connection() as conn:
+        cursor = conn.execute(sql, params)
+        for batch in iter(lambda: cursor.fetchmany(FETCH_SIZE), []):
+            for row in batch:
+                yield convert(row)
+
+
+def stream_response(rows, format='json', key=None, tail=None, headers=None, background=None):
+    """StreamingResponse с JSON (массив или объект с key) либо NDJSON.
+
+    background выполняется после отдачи всего потока или обрыва соединения клиентом.
+    """
+    if format == 'ndjson':
+        return StreamingResponse(iter_ndjson(rows, tail), media_type='application/x-ndjson', headers=headers,
+                                 background=background)
+    return StreamingResponse(iter_json(rows, key, tail), media_type='application/json', headers=headers,
+                             background=background)
@@ -1,24 +1,148 @@
-import io
+import os
 import sqlite3
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 
-import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
-from fastapi import FastAPI, Query
+from fastapi import Depends, FastAPI, HTTPException, Query, Response
 from fastapi.responses import JSONResponse
-from fastapi.responses import StreamingResponse
 
-app = FastAPI()
+import analytics
+import charts
+import dataset_store
+import json_stream
+import series
+import supplier_search
+from response_cache import ResponseCache
+from snapshots import Snapshot, SnapshotManager, data_file
+
+# Размер страницы по умолчанию и максимальный для постраничных эндпоинтов
+PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+
+# Каталог выгрузок: /admin/reload принимает только файлы из него
+DATA_DIR = './data'
+DATA_PATH = os.path.join(DATA_DIR, 'TenderHack_20250228_1900.xlsx')
+# Графики побед скольких крупнейших победителей отрисовываются заранее после загрузки данных
+CHART_PRERENDER_TOP = 20
+# Файл общего для всех процессов уровня кэша ответов (например, 'response_cache.db'); None - только память
+RESPONSE_CACHE_DB = None
+
+# Ключи группировок колоночного движка (analytics); строятся при конвертации выгрузки (dataset_store)
+WINNER = dataset_store.WINNER
+WINNER_GROUP = dataset_store.WINNER_GROUP
+CUSTOMER_NAME = dataset_store.CUSTOMER_NAME
+SUPPLIER_NAME = dataset_store.SUPPLIER_NAME
+END_PRICE = dataset_store.END_PRICE
+# Поиск побед по ИНН: exact - точное совпадение, prefix - все ИНН, начинающиеся с введённых цифр
+MATCH_PATTERN = '^(exact|prefix)$'
+# Колонки точек /wins_dots и /kpi и строк /sessions
+POINT_COLUMNS = ['Окончание КС', 'Начальная цена КС', 'Конечная цена КС (победителя в КС)']
+SESSION_COLUMNS = ['Id КС', 'Ссылка на КС', 'ИНН заказчика', 'Наименование заказчика', 'Регион заказчика',
+                   'Закон-основание', 'Начало КС', 'Окончание КС', 'Начальная цена КС',
+                   'Конечная цена КС (победителя в КС)', 'ИНН победителя КС', 'Код КПГЗ', 'Наименование КПГЗ']
+
+
+def load_dataset(path):
+    """Снимок данных: выгрузка и индексы поверх неё."""
+    print("Dataset started")
+    # Выгрузка конвертируется в колоночное хранилище один раз (или python dataset_store.py),
+    # дальше все процессы открывают его через mmap: строковые колонки - category или буфер UTF-8, только чтение.
+    # Индексы (участники, поиск поставщиков, группировки analytics) хранятся там же и тоже не строятся заново
+    df, indexes = dataset_store.open_dataset(path)
+    # Вывод типов всех колонок и занимаемой памяти (профиль типов - dataset_store.apply_profile)
+    print(df.dtypes)
+    print(f"Dataset loaded: {len(df)} rows, {dataset_store.memory_mib(df):.1f} MiB")
+
+    participant_index = indexes['participants']
+    print(f"Participant index: {len(participant_index)} INNs")
+    supplier_index = indexes['suppliers']
+    print(f"Supplier search index: {len(supplier_index)} suppliers")
+    engine = indexes['analytics']
+    print(f"Analytics: {len(engine.group(*WINNER))} winners")
+    return Snapshot(dataset_store.source_version(path), path=path, df=df, participant_index=participant_index,
+                    supplier_index=supplier_index, analytics=engine, winner_index=engine.key_index(WINNER[0]))
+
+
+# Текущие данные; POST /admin/reload или наблюдатель за файлом выгрузки переключают их без перезапуска
+dataset = SnapshotManager(load_dataset)
+dataset.reload(path=DATA_PATH)
+
+# Ответы по ИНН зависят только от параметров и версии выгрузки (Snapshot.version)
+response_cache = ResponseCache(disk_path=RESPONSE_CACHE_DB)
+# Графики рисуются в пуле процессов и кэшируются так же по версии
+chart_service = charts.ChartService()
+
+
+def top_customers_chart(engine, count):
+    """Топ-N заказчиков по количеству КС и задание для charts.bar_chart."""
+    top_customers = engine.top_counts(CUSTOMER_NAME, count)
+    return top_customers, (charts.bar_chart, top_customers.index.tolist(), top_customers.tolist(),
+                           f'Топ-{count} заказчиков по количеству КС', 'Заказчики', 'Количество КС', 'skyblue',
+                           (20, 6))
+
+
+def top_suppliers_chart(engine, count):
+    """Топ-N поставщиков по общей сумме выигранных КС и задание для charts.bar_chart."""
+    top_suppliers = engine.top_sums(SUPPLIER_NAME, END_PRICE, count)
+    return top_suppliers, (charts.bar_chart, top_suppliers.index.tolist(), top_suppliers.tolist(),
+                           f'Топ-{count} поставщиков по общей сумме выигранных КС', 'Поставщики',
+                           'Сумма выигранных КС', 'lightgreen', (10, 6))
+
+
+def winner_rows(snapshot, inn, match='exact', columns=None):
+    """Строки выгрузки, где ИНН является победителем, по индексу winner_index (O(числа побед)).
+
+    columns - нужные колонки: копируются только они, а не все колонки найденных строк.
+    """
+    rows = snapshot.winner_index.find(inn, match)
+    if columns is None:
+        return snapshot.df.iloc[rows]
+    return snapshot.df.iloc[rows, snapshot.df.columns.get_indexer(columns)]
+
+
+def wins_chart(snapshot, inn, match='exact'):
+    """Победы ИНН (дата окончания и конечная цена КС) и задание для charts.scatter_chart."""
+    filtered_data = winner_rows(snapshot, inn, match, ['Окончание КС', 'Конечная цена КС (победителя в КС)'])
+    return filtered_data, (charts.scatter_chart, filtered_data['Окончание КС'].to_numpy(),
+                           filtered_data['Конечная цена КС (победителя в КС)'].to_numpy(),
+                           f'Победы в КС: {inn}', 'Дата окончания КС', 'Конечная цена КС')
+
+
+def prerender_charts(snapshot):
+    """После загрузки данных заранее рисует топ-графики и графики побед крупнейших победителей."""
+    key = chart_service.cache.key
+    engine = snapshot.analytics
+    jobs = [(key('/top_customers_plot.jpg', snapshot.version, count=15), top_customers_chart(engine, 15)[1]),
+            (key('/top_suppliers_plot.jpg', snapshot.version, count=10), top_suppliers_chart(engine, 10)[1])]
+    for inn in analytics.label_strings(engine.top_counts(WINNER, CHART_PRERENDER_TOP).index):
+        jobs.append((key('/wins_plot.jpg', snapshot.version, inn=inn, match='exact'), wins_chart(snapshot, inn)[1]))
+    chart_service.prerender(jobs)
+
+
+def on_dataset_reload(snapshot):
+    response_cache.clear(snapshot.version)
+    chart_service.clear(snapshot.version)
+    prerender_charts(snapshot)
+
 
-print("XLS started")
-df = pd.read_excel('./data/TenderHack_20250228_1900.xlsx', sheet_name=0)  # sheet_name=0 для первого листа
-# Вывод типов всех колонок
-print(df.dtypes)
-df['Окончание КС'] = pd.to_datetime(df['Окончание КС'], errors='coerce')
-print(df.dtypes)
-print("XLS loaded")
+dataset.on_reload(on_dataset_reload)
 
-conn = sqlite3.connect("tender.db")
+
+@asynccontextmanager
+async def lifespan(app):
+    prerender_charts(dataset.current)
+    dataset.watch(lambda snapshot: dataset_store.source_version(snapshot.path))
+    yield
+    dataset.close()
+    chart_service.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+TENDER_DB = "tender.db"
+conn = sqlite3.connect(TENDER_DB)
 
 
 @app.get("/")
@@ -26,180 +150,146 @@ def hello():
     return {"message": "Hello World2"}
 
 
-@app.get("/winners")
-def get_winners():
-    global df
-    # Загрузка данных из файла Excel (замените 'data.xlsx' на ваш файл)
-    # Группируем данные по ИНН и подсчитываем количество побед
-    result = df.groupby(['ИНН победителя КС', 'Наименование победителя КС', 'Регион победителя КС']).size().reset_index(
-        name='Количество побед')
+# Перезагрузка выгрузки (новый файл path из DATA_DIR или тот же после замены). Идущие запросы дорабатывают
+# на старых данных
+@app.post("/admin/reload")
+def reload_dataset(path: str = Query(None)):
+    try:
+        path = path and data_file(path, DATA_DIR)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    snapshot = dataset.reload(path=path)
+    return {"version": snapshot.version, "path": snapshot.path}
+
+
+@app.get("/admin/cache")
+def get_cache_metrics():
+    return response_cache.metrics()
 
-    # Сортируем по количеству побед в порядке убывания и выбираем топ-100
-    top_winners = result.sort_values(by='Количество побед', ascending=False).head(100)
+
+@app.get("/winners")
+def get_winners(data: Snapshot = Depends(dataset.dependency)):
+    # Топ-100 групп (ИНН, наименование, регион) по количеству побед из готовой группировки
+    top_winners = data.analytics.top_counts(WINNER_GROUP, 100).reset_index(name='Количество побед')
 
     # Преобразуем результат в формат JSON
     return top_winners.to_dict(orient='records')
 
 
+# Постранично по ИНН: следующая страница запрашивается с cursor из заголовка X-Next-Cursor
 @app.get("/unique_inns")
-def get_unique_inns():
-    global df
-
-    # Подсчитываем количество уникальных значений ИНН и их упоминания
-    unique_inns = df['ИНН победителя КС'].value_counts().reset_index()
-    unique_inns.columns = ['ИНН победителя КС', 'Количество упоминаний']
-
-    # Преобразуем результат в формат JSON
-    return unique_inns.to_dict(orient='records')
+def get_unique_inns(response: Response,
+                    cursor: str = Query(None),
+                    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                    data: Snapshot = Depends(dataset.dependency)):
+    # Уникальные ИНН строками по возрастанию и количество их упоминаний (считаются при загрузке).
+    # Порядок - по ИНН, а не по числу упоминаний: по нему работает cursor
+    inns, counts = data.analytics.counts_by_label(WINNER[0])
+
+    # Страница после cursor
+    start = inns.searchsorted(cursor, side='right') if cursor is not None else 0
+    page_inns, page_counts = inns[start:start + limit], counts[start:start + limit]
+    if len(page_inns) == limit:
+        response.headers['X-Next-Cursor'] = page_inns[-1]
+
+    # Преобразуем результат в формат JSON; числовые ИНН отдаются числами, как до постраничной выдачи
+    if data.df[WINNER[0]].dtype.kind in 'iuf':
+        page_inns = page_inns.astype(np.int64)
+    return [{'ИНН победителя КС': inn, 'Количество упоминаний': count}
+            for inn, count in zip(page_inns.tolist(), page_counts.tolist())]
 
 
 @app.get("/inns")
-def get_inns(q: str = Query(None)):
-    global df
-    # Извлечение необходимых колонок
-    suppliers = df[['ИНН победителя КС', 'Наименование победителя КС']].drop_duplicates()
-
-    # Фильтрация по параметру q, если он задан
-    if q:
-        suppliers = suppliers[
-            suppliers['ИНН победителя КС'].astype(str).str.contains(q, case=False) |
-            suppliers['Наименование победителя КС'].str.contains(q, case=False)
-            ]
-
-    # Переименование колонок
-    suppliers = suppliers.rename(columns={
-        'ИНН победителя КС': 'inn',
-        'Наименование победителя КС': 'name'
-    })
-
-    # Сортировка по колонке 'inn'
-    suppliers = suppliers.sort_values(by='inn')
+def get_inns(q: str = Query(None), limit: int = Query(supplier_search.DEFAULT_LIMIT, ge=1, le=MAX_PAGE_SIZE),
+             data: Snapshot = Depends(dataset.dependency)):
+    # С параметром q - подсказки из префиксного индекса, лучшие совпадения первыми (не больше limit).
+    # Без q - все поставщики, отсортированные по ИНН
+    suppliers = data.supplier_index.search(q, limit) if q else data.supplier_index.entries
 
     # Преобразование в список словарей
-    suppliers_list = suppliers.to_dict(orient='records')
+    suppliers_list = [{'inn': inn, 'name': name} for inn, name in suppliers]
 
     return JSONResponse(content=suppliers_list)
 
 
 @app.get("/top_customers_plot.jpg")
-def get_top_customers_plot(count: int = Query(10, ge=1)):
-    global df
+def get_top_customers_plot(count: int = Query(10, ge=1), data: Snapshot = Depends(dataset.dependency)):
     # Топ-N заказчиков по количеству КС
     count = 15
-    top_customers = df['Наименование заказчика'].value_counts().nlargest(count)
+    key = chart_service.cache.key('/top_customers_plot.jpg', data.version, count=count)
+    cached = chart_service.cache.get(key)
+    if cached is not None:
+        return cached
+    top_customers, chart = top_customers_chart(data.analytics, count)
 
     # Проверка, если количество запрашиваемых значений больше доступных
     if len(top_customers) < count:
         return {"error": f"Запрашиваемое количество {count} превышает доступные значения: {len(top_customers)}"}
 
-    # Создание графика
-    plt.figure(figsize=(20, 6))
-    top_customers.plot(kind='bar', color='skyblue')
-    plt.title(f'Топ-{count} заказчиков по количеству КС', fontsize=16)
-    plt.xlabel('Заказчики', fontsize=14)
-    plt.ylabel('Количество КС', fontsize=14)
-    plt.xticks(rotation=45, ha='right')
-    plt.grid(axis='y', linestyle='--', alpha=0.7)
-
-    # Использование tight_layout для автоматической настройки отступов
-    plt.tight_layout()
-
-    # Сохранение графика в буфер
-    buf = io.BytesIO()
-    plt.savefig(buf, format='jpg', bbox_inches='tight')
-    buf.seek(0)
-    plt.close()  # Закрываем график, чтобы избежать утечек памяти
-
-    return StreamingResponse(buf, media_type="image/jpeg")
+    # Создание графика в пуле процессов отрисовки
+    return chart_service.render_sync(key, *chart)
 
 
 @app.get("/top_suppliers_plot.jpg")
-def get_top_suppliers_plot(count: int = Query(10, ge=1)):
-    global df
+def get_top_suppliers_plot(count: int = Query(10, ge=1), data: Snapshot = Depends(dataset.dependency)):
     # Топ-N поставщиков по общей сумме выигранных КС
-    top_suppliers = df.groupby('Наименование победителя КС')['Конечная цена КС (победителя в КС)'].sum().nlargest(count)
+    key = chart_service.cache.key('/top_suppliers_plot.jpg', data.version, count=count)
+    cached = chart_service.cache.get(key)
+    if cached is not None:
+        return cached
+    top_suppliers, chart = top_suppliers_chart(data.analytics, count)
 
     # Проверка, если количество запрашиваемых значений больше доступных
     if len(top_suppliers) < count:
         return {"error": f"Запрашиваемое количество {count} превышает доступные значения: {len(top_suppliers)}"}
 
-    # Создание графика
-    plt.figure(figsize=(10, 6))
-    top_suppliers.plot(kind='bar', color='lightgreen')
-    plt.title(f'Топ-{count} поставщиков по общей сумме выигранных КС', fontsize=16)
-    plt.xlabel('Поставщики', fontsize=14)
-    plt.ylabel('Сумма выигранных КС', fontsize=14)
-    plt.xticks(rotation=45, ha='right')
-    plt.grid(axis='y', linestyle='--', alpha=0.7)
-
-    # Использование tight_layout для автоматической настройки отступов
-    plt.tight_layout()
-
-    # Сохранение графика в буфер
-    buf = io.BytesIO()
-    plt.savefig(buf, format='jpg', bbox_inches='tight')
-    buf.seek(0)
-    plt.close()  # Закрываем график, чтобы избежать утечек памяти
-
-    return StreamingResponse(buf, media_type="image/jpeg")
+    # Создание графика в пуле процессов отрисовки
+    return chart_service.render_sync(key, *chart)
 
 
 @app.get("/sessions")
-async def get_sessions(inn: str = Query(...)):
-    global df
-    # Фильтрация по ИНН в колонке "Участники КС - поставщики"
-    filtered_sessions = df[df['Участники КС - поставщики'].str.contains(inn, na=False)]
-
-    # Выбор необходимых колонок
-    selected_columns = filtered_sessions[['Id КС', 'Ссылка на КС', 'ИНН заказчика',
-                                          'Наименование заказчика', 'Регион заказчика',
-                                          'Закон-основание', 'Начало КС', 'Окончание КС',
-                                          'Начальная цена КС', 'Конечная цена КС (победителя в КС)',
-                                          'ИНН победителя КС', 'Код КПГЗ', 'Наименование КПГЗ']]
-
-    # Дедупликация
-    deduplicated_sessions = selected_columns.drop_duplicates()
-
-    # Добавление колонки "Победитель"
-    deduplicated_sessions['Победитель'] = deduplicated_sessions['ИНН победителя КС'] == inn
+async def get_sessions(inn: str = Query(...), format: str = Query('json', pattern=json_stream.FORMAT_PATTERN),
+                       data: Snapshot = Depends(dataset.dependency)):
+    key = response_cache.key('/sessions', data.version, inn=inn, format=format)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+
+    df = data.df
+    # Точный поиск КС, где ИНН среди участников, по индексу participant_index; копируются только нужные колонки
+    rows = data.participant_index.get(inn)
+    selected_columns = df.iloc[rows, df.columns.get_indexer(SESSION_COLUMNS)]
+
+    # Добавление колонки "Победитель" (по индексу побед: ИНН победителя в выгрузке - число, inn - строка)
+    # и дедупликация
+    deduplicated_sessions = selected_columns.assign(
+        Победитель=np.isin(rows, data.winner_index.get(inn))).drop_duplicates()
 
     # Добавление вычисляемой колонки "Размер уступки"
     # deduplicated_sessions['Размер уступки'] = deduplicated_sessions['Начальная цена КС'] - deduplicated_sessions[
     #     'Конечная цена КС (победителя в КС)']
 
-    # Преобразование в список словарей
-    result_list = deduplicated_sessions.to_dict(orient='records')
-    print(result_list)
-    return JSONResponse(content=result_list)
+    # Потоковая отдача строк без промежуточного списка словарей
+    columns = list(deduplicated_sessions.columns)
+    rows = (dict(zip(columns, values)) for values in deduplicated_sessions.itertuples(index=False, name=None))
+    return response_cache.stream(key, json_stream.stream_response(rows, format))
 
 
 @app.get("/wins_plot.jpg")
-async def get_wins_plot(inn: str = Query(...)):
-    global df
-    print(df)
-    # Фильтрация данных по ИНН, где ИНН является победителем
-    filtered_data = df[df['ИНН победителя КС'].astype(str).str.contains(inn)]
-    print(filtered_data)
+async def get_wins_plot(inn: str = Query(...), match: str = Query('exact', pattern=MATCH_PATTERN),
+                        data: Snapshot = Depends(dataset.dependency)):
+    key = chart_service.cache.key('/wins_plot.jpg', data.version, inn=inn, match=match)
+    cached = chart_service.cache.get(key)
+    if cached is not None:
+        return cached
+    filtered_data, chart = wins_chart(data, inn, match)
 
     # Проверка, есть ли данные для построения графика
     if filtered_data.empty:
         return {"message": "Нет данных для указанного ИНН."}
 
-    # Создание графика
-    plt.figure(figsize=(10, 6))
-    plt.scatter(filtered_data['Окончание КС'], filtered_data['Конечная цена КС (победителя в КС)'], color='blue')
-    plt.title(f'Победы в КС: {inn}')
-    plt.xlabel('Дата окончания КС')
-    plt.ylabel('Конечная цена КС')
-    plt.xticks(rotation=45)
-    plt.grid()
-
-    buf = io.BytesIO()
-    plt.savefig(buf, format='jpg', bbox_inches='tight')
-    buf.seek(0)
-    plt.close()  # Закрываем график, чтобы избежать утечек памяти
-
-    return StreamingResponse(buf, media_type="image/jpeg")
+    # Создание графика в пуле процессов отрисовки
+    return await chart_service.render(key, *chart)
 
     #
     # # Сохранение графика в формате JPG
@@ -211,28 +301,53 @@ async def get_wins_plot(inn: str = Query(...)):
     # return FileResponse(plot_filename, media_type='image/jpeg', filename=plot_filename)
 
 
-@app.get("/wins_dots")
-async def get_wins_dots(inn: str = Query(...)):
-    global df
-    print(df)
-    # Фильтрация данных по ИНН, где ИНН является победителем
-    filtered_data = df[df['ИНН победителя КС'].astype(str).str.contains(inn)]
-    print(filtered_data)
+# Данные /wins_plot.jpg для графика на стороне клиента: колонки dates/values, прореженные до points точек
+@app.get("/series/wins")
+def get_wins_series(inn: str = Query(...),
+                    points: int = Query(series.DEFAULT_POINTS, ge=3, le=series.MAX_POINTS),
+                    method: str = Query('lttb', pattern=series.METHOD_PATTERN),
+                    aggregate: str = Query('sum', pattern=series.AGGREGATE_PATTERN),
+                    match: str = Query('exact', pattern=MATCH_PATTERN),
+                    data: Snapshot = Depends(dataset.dependency)):
+    key = response_cache.key('/series/wins', data.version, inn=inn, points=points, method=method, aggregate=aggregate,
+                             match=match)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
 
-    # Проверка, есть ли данные для построения графика
-    if filtered_data.empty:
-        return {"message": "Нет данных для указанного ИНН."}
+    filtered_data = winner_rows(data, inn, match, ['Окончание КС', 'Конечная цена КС (победителя в КС)'])
+    ends = filtered_data['Окончание КС']
+    result = series.downsample((ends.astype('int64') // 10 ** 9).where(ends.notna()),
+                               filtered_data['Конечная цена КС (победителя в КС)'], points, method, aggregate)
+    return response_cache.put(key, JSONResponse(content={'inn': inn, 'method': method, **result}))
 
+
+@app.get("/wins_dots")
+async def get_wins_dots(inn: str = Query(...), match: str = Query('exact', pattern=MATCH_PATTERN),
+                        data: Snapshot = Depends(dataset.dependency)):
     # Получение текущей даты и даты два года назад
     current_date = datetime.now()
     two_years_ago = current_date - timedelta(days=730)  # 2 года = 730 дней
 
+    key = response_cache.key('/wins_dots', data.version, inn=inn, match=match,
+                             since=two_years_ago.strftime('%Y-%m-%d'))
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+
+    # Победы ИНН по индексу winner_index, только колонки точек графика
+    filtered_data = winner_rows(data, inn, match, POINT_COLUMNS)
+    print(filtered_data)
+
+    # Проверка, есть ли данные для построения графика
+    if filtered_data.empty:
+        return response_cache.put(key, {"message": "Нет данных для указанного ИНН."})
+
     # Фильтрация данных за последние 2 года
     filtered_data = filtered_data[filtered_data['Окончание КС'] >= two_years_ago]
 
     # Создание графика
-    points = filtered_data[
-        ['Окончание КС', 'Начальная цена КС', 'Конечная цена КС (победителя в КС)']].drop_duplicates()
+    points = filtered_data.drop_duplicates()
     points = points.rename(columns={'Окончание КС': 'ks_date', 'Начальная цена КС': 'ks_start_price',
                                     'Конечная цена КС (победителя в КС)': 'ks_end_price'})
 
@@ -266,7 +381,7 @@ async def get_wins_dots(inn: str = Query(...)):
     }
     # Преобразование в список словарей
     result_list = points.to_dict(orient='records')
-    return JSONResponse(content={"summary": summary, "data": result_list})
+    return response_cache.put(key, JSONResponse(content={"summary": summary, "data": result_list}))
     # return JSONResponse(content=result_list)
 
     #
@@ -282,28 +397,23 @@ async def get_wins_dots(inn: str = Query(...)):
 @app.get("/wins_plot_sql.jpg")
 async def get_wins_plot_sql(inn: str = Query(...)):
     global conn
+    # Версия - время изменения и размер tender.db
+    key = chart_service.cache.key('/wins_plot_sql.jpg', dataset_store.source_version(TENDER_DB), inn=inn)
+    cached = chart_service.cache.get(key)
+    if cached is not None:
+        return cached
+
     # ГРАФИК ПОЛУЧЕНИЯ ПОБЕД В РАЗРЕЗЕ ДАТА И КОНЕЧНАЯ ЦЕНА
-    GET_WINNS_COST_AND_DATA = f'''SELECT DISTINCT data."id КС", data."Конечная цена КС (победителя в КС)", data."Окончание КС"
+    GET_WINNS_COST_AND_DATA = '''SELECT DISTINCT data."id КС", data."Конечная цена КС (победителя в КС)", data."Окончание КС"
     from data
-    WHERE data."ИНН победителя КС" = \'{inn}\''''
-    postavshik_df = pd.read_sql_query(GET_WINNS_COST_AND_DATA, conn)
+    WHERE data."ИНН победителя КС" = ?'''
+    postavshik_df = pd.read_sql_query(GET_WINNS_COST_AND_DATA, conn, params=(inn,))
     print(postavshik_df)
 
-    # Создание графика
-    plt.figure(figsize=(10, 6))
-    plt.scatter(postavshik_df['Окончание КС'], postavshik_df['Конечная цена КС (победителя в КС)'], color='blue')
-    plt.title(f'Победы в КС: {inn}')
-    plt.xlabel('Дата окончания КС')
-    plt.ylabel('Конечная цена КС')
-    plt.xticks(rotation=45)
-    plt.grid()
-
-    buf = io.BytesIO()
-    plt.savefig(buf, format='jpg', bbox_inches='tight')
-    buf.seek(0)
-    plt.close()  # Закрываем график, чтобы избежать утечек памяти
-
-    return StreamingResponse(buf, media_type="image/jpeg")
+    # Создание графика в пуле процессов отрисовки
+    return await chart_service.render(key, charts.scatter_chart, postavshik_df['Окончание КС'].tolist(),
+                                      postavshik_df['Конечная цена КС (победителя в КС)'].tolist(),
+                                      f'Победы в КС: {inn}', 'Дата окончания КС', 'Конечная цена КС')
 
     #
     # # Сохранение графика в формате JPG
@@ -316,19 +426,23 @@ async def get_wins_plot_sql(inn: str = Query(...)):
 
 
 @app.get("/kpi")
-async def get_kpi(inn: str = Query(...)):
-    global df
-    # Фильтрация данных по ИНН, где ИНН является победителем
-    filtered_data = df[df['ИНН победителя КС'].astype(str).str.contains(inn)]
+async def get_kpi(inn: str = Query(...), match: str = Query('exact', pattern=MATCH_PATTERN),
+                  data: Snapshot = Depends(dataset.dependency)):
+    key = response_cache.key('/kpi', data.version, inn=inn, match=match)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+
+    # Победы ИНН по индексу winner_index, только колонки точек графика
+    filtered_data = winner_rows(data, inn, match, POINT_COLUMNS)
     print(filtered_data)
 
     # Проверка, есть ли данные для построения графика
     if filtered_data.empty:
-        return {"message": "Нет данных для указанного ИНН."}
+        return response_cache.put(key, {"message": "Нет данных для указанного ИНН."})
 
     # Создание графика
-    points = filtered_data[
-        ['Окончание КС', 'Начальная цена КС', 'Конечная цена КС (победителя в КС)']].drop_duplicates()
+    points = filtered_data.drop_duplicates()
     points = points.rename(columns={'Окончание КС': 'ks_date', 'Начальная цена КС': 'ks_start_price',
                                     'Конечная цена КС (победителя в КС)': 'ks_end_price'})
 
@@ -342,7 +456,7 @@ async def get_kpi(inn: str = Query(...)):
 
     # Преобразование в список словарей
     result_list = points.to_dict(orient='records')
-    return JSONResponse(content=result_list)
+    return response_cache.put(key, JSONResponse(content=result_list))
     # return JSONResponse(content=result_list)
 
     #
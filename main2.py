@@ -1,13 +1,85 @@
+import os
 import sqlite3
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 from typing import List, Optional
 
-from fastapi import FastAPI, Query, Request
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
+from starlette.background import BackgroundTask
 import pandas as pd
 
-app = FastAPI()
+import json_stream
+import queries
+import rollups
+import series
+from db_pool import AsyncDatabase, ConnectionPool
+from response_cache import ResponseCache
+from snapshots import Snapshot, SnapshotManager, data_file
+
+# Файл общего для всех процессов уровня кэша ответов (например, 'response_cache.db'); None - только память
+RESPONSE_CACHE_DB = None
+# Максимум ИНН в одном запросе к /batch/*
+MAX_BATCH = 100
+# Точное совпадение или префикс (kpgz_code в /sessions)
+MATCH_PATTERN = '^(exact|prefix)$'
+# Каталог баз: /admin/reload принимает только файлы из него
+DATA_DIR = '.'
+
+
+def read_data_version(pool):
+    try:
+        with pool.connection() as conn:
+            row = conn.execute(queries.DATA_VERSION).fetchone()
+    except sqlite3.OperationalError:
+        return None  # Базы ещё нет или она загружена до появления import_meta
+    return row[0] if row else None
+
+
+def load_databases(tender7_path, tender_path):
+    """Снимок баз: пулы read-only соединений к нормализованной базе и к сырой таблице data.
+
+    Соединение берётся на время запроса (with ...connection() as conn) и возвращается в пул.
+    Первое соединение открывается здесь же, до подмены снимка.
+    """
+    tender7_pool = ConnectionPool(tender7_path)
+    tender_pool = ConnectionPool(tender_path)
+    # Для async-эндпоинтов: запросы уходят в отдельный пул потоков, event loop не блокируется
+    tender7_db = AsyncDatabase(tender7_pool)
+
+    def close():
+        tender7_db.close()
+        tender7_pool.close()
+        tender_pool.close()
+
+    return Snapshot(read_data_version(tender7_pool), close, tender7_pool=tender7_pool, tender_pool=tender_pool,
+                    tender7_db=tender7_db, paths=(tender7_path, tender_path))
+
+
+def databases_state(snapshot):
+    # Базу подменили новым файлом или дописали в неё новую загрузку
+    inodes = tuple(os.stat(path).st_ino if os.path.exists(path) else None for path in snapshot.paths)
+    return inodes, read_data_version(snapshot.tender7_pool)
+
+
+# Текущие базы; POST /admin/reload или наблюдатель переключают их без перезапуска
+databases = SnapshotManager(load_databases)
+databases.reload(tender7_path='Tender7.db', tender_path='tender.db')
+
+# Ответы аналитики по ИНН зависят только от параметров и версии данных (Snapshot.version)
+response_cache = ResponseCache(disk_path=RESPONSE_CACHE_DB)
+databases.on_reload(lambda snapshot: response_cache.clear(snapshot.version))
+
+
+@asynccontextmanager
+async def lifespan(app):
+    databases.watch(databases_state)
+    yield
+    databases.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 # Модель для фирмы
@@ -35,45 +107,41 @@ class Session(BaseModel):
     discount_size: float  # Размер уступки
 
 
-conn2 = sqlite3.connect('tender.db', check_same_thread=False)
+# Перезагрузка баз: новые файлы (db, raw_db) из DATA_DIR или те же после загрузки. Идущие запросы дорабатывают
+# на старых
+@app.post("/admin/reload")
+def reload_databases(db: Optional[str] = Query(None), raw_db: Optional[str] = Query(None)):
+    try:
+        db, raw_db = (path and data_file(path, DATA_DIR) for path in (db, raw_db))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    snapshot = databases.reload(tender7_path=db, tender_path=raw_db)
+    return {"version": snapshot.version, "db": snapshot.paths[0], "raw_db": snapshot.paths[1]}
 
 
-# Функция для получения соединения с базой данных
-def get_db_connection():
-    conn = sqlite3.connect('Tender7.db')
-    conn.row_factory = sqlite3.Row  # Позволяет обращаться к столбцам по имени
-    return conn
+@app.get("/admin/cache")
+def get_cache_metrics():
+    return response_cache.metrics()
 
 
 # Эндпоинт для получения списка фирм
+# Постранично: следующая страница запрашивается с cursor из заголовка X-Next-Cursor
 @app.get("/inns", response_model=List[Firma])
-def get_firms():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT inn, firma_name AS name, firma_region AS region FROM firma")
-    firms = cursor.fetchall()
-    conn.close()
+def get_firms(response: Response,
+              cursor: Optional[str] = Query(None),
+              limit: int = Query(queries.PAGE_SIZE, ge=1, le=queries.MAX_PAGE_SIZE),
+              region: Optional[str] = Query(None),
+              data: Snapshot = Depends(databases.dependency)):
+    with data.tender7_pool.connection() as conn:
+        firms = conn.execute(*queries.firms_page(cursor, limit, region)).fetchall()
+    if len(firms) == limit:
+        response.headers['X-Next-Cursor'] = firms[-1]['inn']
     return [Firma(inn=row['inn'], name=row['name'], region=row['region']) for row in firms]
 
 
 # Эндпоинт для получения списка котировочных сессий
-@app.get("/sessions")
-def get_sessions():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT ks.ks_id AS id_ks, ks.ks_url, ks.customer_inn, f1.firma_name AS customer_name, 
-               f1.firma_region AS customer_region, ks.fz, ks.start_time, ks.end_time, 
-               ks.start_price, ks.end_price, ks.winner_inn, kpgz.kpgz_code, kpgz.kpgz_name,
-               ks.end_price - ks.start_price as discount_size
-        FROM ks
-        LEFT JOIN firma AS f1 ON ks.customer_inn = f1.inn
-        LEFT JOIN firma AS f2 ON ks.winner_inn = f2.inn
-        LEFT JOIN kpgz ON ks.kpgz_code = kpgz.kpgz_code
-    ''')
-    sessions = cursor.fetchall()
-    conn.close()
-    return JSONResponse([{
+def session_record(row):
+    return {
         'Id КС': row['id_ks'],
         'Ссылка на КС': row['ks_url'],
         'ИНН заказчика': row['customer_inn'],
@@ -88,64 +156,71 @@ def get_sessions():
         'Код КПГЗ': row['kpgz_code'],
         'Наименование КПГЗ': row['kpgz_name'],
         'Размер уступки': row['discount_size']
-    } for row in sessions])
+    }
 
 
-@app.get("/wins_dots")
-async def get_wins_dots(inn: str = Query(...)):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    # Фильтрация данных по ИНН, где ИНН является победителем
-    cursor.execute('''
-        SELECT ks.end_time AS ks_date, ks.start_price AS ks_start_price, ks.end_price AS ks_end_price
-        FROM ks
-        WHERE ks.winner_inn = ?
-    ''', (inn,))
-    filtered_data = cursor.fetchall()
-
-    # Проверка, есть ли данные для построения графика
-    if not filtered_data:
-        return {"message": "Нет данных для указанного ИНН."}
+# Постранично по ks_id: следующая страница запрашивается с cursor из заголовка X-Next-Cursor.
+# format=ndjson - потоковая выгрузка всех подходящих КС (или до limit) без накопления в памяти.
+@app.get("/sessions")
+def get_sessions(cursor: Optional[int] = Query(None),
+                 limit: Optional[int] = Query(None, ge=1),
+                 customer_inn: Optional[str] = Query(None),
+                 winner_inn: Optional[str] = Query(None),
+                 kpgz_code: Optional[str] = Query(None),
+                 fz: Optional[str] = Query(None),
+                 start_date: Optional[str] = Query(None),
+                 end_date: Optional[str] = Query(None),
+                 kpgz_match: str = Query('prefix', pattern=MATCH_PATTERN),
+                 format: str = Query('json', pattern=json_stream.FORMAT_PATTERN)):
+    filters = (customer_inn, winner_inn, kpgz_code, fz, start_date, end_date, kpgz_match)
+    data = databases.acquire()
+    if format == 'ndjson':
+        # LIMIT -1 в SQLite - без ограничения. Снимок удерживается до конца отдачи потока
+        sql, params = queries.sessions_page(cursor, limit or -1, *filters)
+        return json_stream.stream_response(
+            json_stream.pooled_rows(data.tender7_pool, sql, params, session_record), format,
+            background=BackgroundTask(databases.release, data))
+
+    limit = min(limit or queries.PAGE_SIZE, queries.MAX_PAGE_SIZE)
+    try:
+        with data.tender7_pool.connection() as conn:
+            sessions = conn.execute(*queries.sessions_page(cursor, limit, *filters)).fetchall()
+    finally:
+        databases.release(data)
+    headers = {'X-Next-Cursor': str(sessions[-1]['id_ks'])} if len(sessions) == limit else None
+    return JSONResponse(headers=headers, content=[session_record(row) for row in sessions])
+
 
+@app.get("/wins_dots")
+async def get_wins_dots(inn: str = Query(...), data: Snapshot = Depends(databases.dependency)):
     # Получение текущей даты и даты два года назад
     current_date = datetime.now()
     two_years_ago = current_date - timedelta(days=730)  # 2 года = 730 дней
 
-    # Фильтрация данных за последние 2 года
-    filtered_data = [row for row in filtered_data if
-                     datetime.strptime(row['ks_date'][:19], '%Y-%m-%d %H:%M:%S') >= two_years_ago]
-
-    # Создание графика
-    points = []
-    for row in filtered_data:
-        points.append({
-            'ks_date': row['ks_date'],
-            'ks_start_price': round(row['ks_start_price'], 2),  # Округление до сотых
-            'ks_end_price': round(row['ks_end_price'], 2)  # Округление до сотых
-        })
+    key = response_cache.key('/wins_dots', data.version, inn=inn, since=two_years_ago.strftime('%Y-%m-%d'))
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
 
-    # Преобразование в DataFrame для дальнейших вычислений
-    if not points:
-        return {"message": "Нет данных за последние 2 года."}
+    # Проверка, есть ли у ИНН победы вообще
+    if await data.tender7_db.fetchone(queries.HAS_WINS, (inn,)) is None:
+        return response_cache.put(key, {"message": "Нет данных для указанного ИНН."})
 
-    # Вычисление суммы уступки и процента уступки
-    for point in points:
-        point['summa_ustupki'] = round(point['ks_start_price'] - point['ks_end_price'], 2)
-
-    # Группировка по дате и суммирование цен
-    grouped_points = {}
-    for point in points:
-        date = point['ks_date'].split(' ')[0]  # Берем только дату
-        if date not in grouped_points:
-            grouped_points[date] = {
-                'ks_start_price': 0,
-                'ks_end_price': 0,
-                'summa_ustupki': 0,
-            }
-        grouped_points[date]['ks_start_price'] += point['ks_start_price']
-        grouped_points[date]['ks_end_price'] += point['ks_end_price']
-        grouped_points[date]['summa_ustupki'] += point['summa_ustupki']
+    # Победы за последние 2 года, уже сгруппированные по дате окончания КС
+    rows = await data.tender7_db.fetchall(queries.WINS_DOTS, (inn, two_years_ago.strftime('%Y-%m-%d')))
+    return response_cache.put(key, JSONResponse(content=wins_dots_result(rows)))
+
+
+def wins_dots_result(rows):
+    """Ответ /wins_dots по строкам WINS_DOTS одного ИНН, у которого есть победы."""
+    grouped_points = {row['ks_date']: {
+        'ks_start_price': row['ks_start_price'],
+        'ks_end_price': row['ks_end_price'],
+        'summa_ustupki': row['summa_ustupki'],
+    } for row in rows}
+
+    if not grouped_points:
+        return {"message": "Нет данных за последние 2 года."}
 
     # Подсчет общей суммы уступок и среднего процента уступки
     total_discount_sum = round(sum(item['summa_ustupki'] for item in grouped_points.values()), 2)
@@ -164,27 +239,23 @@ async def get_wins_dots(inn: str = Query(...)):
         "average_discount_percentage": average_discount_percentage
     }
 
-    return JSONResponse(content={"summary": summary, "data": result_list})
+    return {"summary": summary, "data": result_list}
 
 
 @app.get("/contracts_by_years")
-async def get_contracts_by_years(inn: str = Query(...)):
-    conn = get_db_connection()
-    cursor = conn.cursor()
+async def get_contracts_by_years(inn: str = Query(...), data: Snapshot = Depends(databases.dependency)):
+    key = response_cache.key('/contracts_by_years', data.version, inn=inn)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
 
     # Запрос для получения количества контрактов по годам
-    cursor.execute('''
-        SELECT strftime('%Y', ks.start_time) AS year, 
-               COUNT(DISTINCT p.ks_id) AS parts_count, 
-               SUM(CASE WHEN ks.winner_inn = ? THEN 1 ELSE 0 END) AS wins_count
-        FROM ks
-        JOIN participant AS p ON ks.ks_id = p.ks_id
-        WHERE p.inn = ?
-        GROUP BY year
-    ''', (inn, inn))
-
-    results = cursor.fetchall()
+    results = await data.tender7_db.fetchall(queries.CONTRACTS_BY_YEARS, (inn,))
+    return response_cache.put(key, JSONResponse(content=contracts_by_years_result(results)))
+
 
+def contracts_by_years_result(results):
+    """Ответ /contracts_by_years по строкам CONTRACTS_BY_YEARS одного ИНН."""
     # Словарь для хранения количества контрактов по годам
     contracts_by_year = {row['year']: {
         'year': row['year'],
@@ -207,31 +278,63 @@ async def get_contracts_by_years(inn: str = Query(...)):
         "all_wins_percentage": round(all_wins_percentage, 2)  # Округление до двух знаков
     }
 
-    return JSONResponse(content={"summary": summary, "data": result_list})
+    return {"summary": summary, "data": result_list}
 
 
-@app.get('/customers')
-def get_start_customers():
-    UNIC_CITY = pd.read_sql_query(
-        '''SELECT data."Регион победителя КС"  FROM data GROUP BY data."Регион победителя КС"''', conn2)
+# Ряды для графиков на стороне клиента: колонки dates/values, прореженные до points точек
+def read_series(conn, sql, params, points, method, aggregate):
+    rows = conn.execute(sql, params).fetchall()
+    return series.downsample([row['ts'] for row in rows], [row['value'] for row in rows], points, method, aggregate)
+
+
+# Все победы ИНН (конечная цена по дате окончания КС) - данные /wins_plot.jpg
+@app.get("/series/wins")
+async def get_wins_series(inn: str = Query(...),
+                          points: int = Query(series.DEFAULT_POINTS, ge=3, le=series.MAX_POINTS),
+                          method: str = Query('lttb', pattern=series.METHOD_PATTERN),
+                          aggregate: str = Query('sum', pattern=series.AGGREGATE_PATTERN),
+                          data: Snapshot = Depends(databases.dependency)):
+    key = response_cache.key('/series/wins', data.version, inn=inn, points=points, method=method, aggregate=aggregate)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+
+    result = await data.tender7_db.run(read_series, queries.WINS_SERIES, (inn,), points, method, aggregate)
+    return response_cache.put(key, JSONResponse(content={'inn': inn, 'method': method, **result}))
+
 
-    UNIC_KPGZ = pd.read_sql_query('''SELECT data."Код КПГЗ"  FROM data GROUP BY data."Код КПГЗ"''', conn2)
+# Дневные показатели ИНН из supplier_daily (metric), по умолчанию суммируются по интервалам времени
+@app.get("/series/daily")
+async def get_daily_series(inn: str = Query(...),
+                           metric: str = Query('end_price', pattern=queries.DAILY_METRIC_PATTERN),
+                           points: int = Query(series.DEFAULT_POINTS, ge=3, le=series.MAX_POINTS),
+                           method: str = Query('bucket', pattern=series.METHOD_PATTERN),
+                           aggregate: str = Query('sum', pattern=series.AGGREGATE_PATTERN),
+                           data: Snapshot = Depends(databases.dependency)):
+    key = response_cache.key('/series/daily', data.version, inn=inn, metric=metric, points=points, method=method,
+                             aggregate=aggregate)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
 
-    UNIC_CUSTOMERS = pd.read_sql_query(
-        '''SELECT data."ИНН заказчика", data."Наименование заказчика"  FROM data GROUP BY data."ИНН заказчика"''',
-        conn2)
+    result = await data.tender7_db.run(read_series, queries.daily_series(metric), (inn,), points, method, aggregate)
+    return response_cache.put(key, JSONResponse(content={'inn': inn, 'metric': metric, 'method': method, **result}))
 
-    kpgz_code_UPD = 'null'
-    winner_region_UPD = 'null'
-    start_date_UPD = 'null'
-    end_date_UPD = 'null'
-    inn_UPD = 'null'
 
-    first100 = pd.read_sql_query(f'''SELECT data."Id КС", data.*  FROM data WHERE 
-    (data."Код КПГЗ" = {kpgz_code_UPD} OR {kpgz_code_UPD} IS NULL) AND
-    (data."Регион победителя КС" = {winner_region_UPD} OR {winner_region_UPD} IS NULL) AND
-    (data."Окончание КС" BETWEEN {start_date_UPD} AND {end_date_UPD} OR ({start_date_UPD} IS NULL AND {end_date_UPD} IS NULL)) AND
-    (data."ИНН победителя КС" = {inn_UPD} OR {inn_UPD} IS NULL) GROUP BY data."Id КС" lIMIT 100''', conn2)
+@app.get('/customers')
+def get_start_customers(data: Snapshot = Depends(databases.dependency)):
+    with data.tender_pool.connection() as conn:
+        UNIC_CITY = pd.read_sql_query(
+            '''SELECT data."Регион победителя КС"  FROM data GROUP BY data."Регион победителя КС"''', conn)
+
+        UNIC_KPGZ = pd.read_sql_query('''SELECT data."Код КПГЗ"  FROM data GROUP BY data."Код КПГЗ"''', conn)
+
+        UNIC_CUSTOMERS = pd.read_sql_query(
+            '''SELECT data."ИНН заказчика", data."Наименование заказчика"  FROM data GROUP BY data."ИНН заказчика"''',
+            conn)
+
+        first100 = pd.read_sql_query(
+            '''SELECT data."Id КС", data.*  FROM data GROUP BY data."Id КС" LIMIT 100''', conn)
 
     return {"city": UNIC_KPGZ.to_dict(orient='records'),
             "kpgz:": UNIC_CITY.to_dict(orient='records'),
@@ -247,134 +350,57 @@ def get_tenders(request: Request,
                 end_date: str = Query(None),
                 inn: str = Query(None),
                 do: str = Query(None),
-                min_price: str = Query(None),
-                max_price: str = Query(None),
+                min_price: float = Query(None),
+                max_price: float = Query(None),
                 customers: str = Query(None),
-                win: str = Query(None)
+                win: str = Query(None),
+                format: str = Query('json', pattern=json_stream.FORMAT_PATTERN)
                 ):
-    # Подключаемся к базе данных
-    conn = sqlite3.connect('tender.db')
-    kpgz_code_UPD = '',
-    winner_region_UPD = ''
-    start_date_UPD = ''
-    end_date_UPD = ''
-    inn_UPD = ''
-    min_price_upd = ''
-    max_price_upd = ''
-    inn_variant_UPD = ''
-    do_upd = ''
-    concatQUERY = ''
-    customers_upd = ''
-    win_upd = ''
-
-    kpgz_code_UPD = 'null' if kpgz_code == None else f'\'{kpgz_code}%\''
-    winner_region_UPD = 'null' if winner_region == None else f'\'{winner_region}\''
-    start_date_UPD = 'null' if start_date == None else f'\'{start_date}\''
-    end_date_UPD = 'null' if end_date == None else f'\'{end_date}\''
-    min_price_upd = 'null' if min_price == None else f'\'{min_price}\''
-    max_price_upd = 'null' if max_price == None else f'\'{max_price}\''
-    customers_upd = 'null' if customers == None else f'\'{customers}\''
-    win_upd = 'null' if win == None else f'\'{inn}\''
-
-    do_upd = 'null' if do == None else f'\'{do}\''
-
-    query = f'''SELECT 
-        DISTINCT data."Id КС", 
-    CAST(TRIM(REPLACE(REPLACE(trim(data."Конечная цена КС (победителя в КС)"), '\t', ''), CHAR(160), '')) AS DECIMAL(10, 2)) AS "Конечная цена КС (победителя в КС)",
-    CAST(TRIM(REPLACE(REPLACE(trim(data."Начальная цена КС"), '\t' , ''), CHAR(160), '')) AS DECIMAL(10, 2)) AS "Начальная цена КС",
-
-    data."Ссылка на КС", data."ИНН заказчика", data."Наименование заказчика", data."Регион заказчика", 
-    data."Начало КС", data."Окончание КС", data."ИНН победителя КС", data."Наименование победителя КС", data."Регион победителя КС",
-    data."Участники КС - поставщики", data."Код КПГЗ", data."Наименование КПГЗ", 
-        CASE 
-           WHEN "Участники КС - поставщики" LIKE '%{inn}%' THEN 'true'
-           ELSE 'false'
-        END AS "do" 
-        FROM data 
-            WHERE 
-                (data."Код КПГЗ" LIKE {kpgz_code_UPD} OR {kpgz_code_UPD} IS NULL) AND
-                (data."Регион победителя КС" = {winner_region_UPD} OR {winner_region_UPD} IS NULL) AND
-                (data."Окончание КС" BETWEEN {start_date_UPD} AND {end_date_UPD} OR ({start_date_UPD} IS NULL AND {end_date_UPD} IS NULL)) AND 
-                (data."Регион победителя КС" = {winner_region_UPD} OR {winner_region_UPD} IS NULL) AND
-                (data."ИНН победителя КС" = {win_upd} OR {win_upd} IS NULL) AND
-                (CAST(TRIM(REPLACE(REPLACE(data."Конечная цена КС (победителя в КС)", CHAR(9), ''), CHAR(160), '')) AS FLOAT) > {min_price_upd} OR {min_price_upd} IS NULL) AND 
-                (CAST(TRIM(REPLACE(REPLACE(data."Конечная цена КС (победителя в КС)", CHAR(9), ''), CHAR(160), '')) AS FLOAT) < {max_price_upd} OR {max_price_upd} IS NULL) AND
-                (data."ИНН заказчика" = {customers} OR {customers} IS NULL) AND
-
-                (do = {do_upd} OR {do_upd} IS NULL) 
-
-
-        GROUP BY data."Id КС"'''
-    print(query)
-
-    params = [kpgz_code_UPD, winner_region_UPD, start_date_UPD, end_date_UPD, inn_UPD]
-    print(params)
-    df = pd.read_sql_query(query, conn)
-
-    print(df.columns)
-
-    df['diff'] = df['Конечная цена КС (победителя в КС)'] / df['Начальная цена КС'] * 100 - 100
-    df['sum_ystupki'] = df['Конечная цена КС (победителя в КС)'] - df['Начальная цена КС']
-    discount = abs(int(df['sum_ystupki'].sum()))
-
-    print(discount)
-    total_sum = df['diff'].sum() / df['Id КС'].count()
-    total_sum_rounded = round(total_sum, 2)
-    print(total_sum)
-    conn.close()
-
-    return {"KPI_DIFF_PROC": total_sum_rounded,
-            "discount": discount,
-            "data": df.to_dict(orient='records')}
+    # Только заданные фильтры и только через параметры
+    query, params = queries.tenders_query(kpgz_code, winner_region, start_date, end_date, inn, do,
+                                          min_price, max_price, customers, win)
+
+    # Итоги считаются на лету по мере отдачи строк и дописываются в конец ответа
+    totals = {'count': 0, 'diff': 0.0, 'sum_ystupki': 0.0}
+
+    def tender_record(row):
+        record = dict(row)
+        end_price = record['Конечная цена КС (победителя в КС)']
+        start_price = record['Начальная цена КС']
+        record['diff'] = end_price / start_price * 100 - 100 if end_price is not None and start_price else None
+        record['sum_ystupki'] = end_price - start_price if end_price is not None and start_price is not None else None
+        totals['count'] += 1
+        totals['diff'] += record['diff'] or 0
+        totals['sum_ystupki'] += record['sum_ystupki'] or 0
+        return record
+
+    def summary():
+        total_sum = totals['diff'] / totals['count'] if totals['count'] else 0
+        return {"KPI_DIFF_PROC": round(total_sum, 2),
+                "discount": abs(int(totals['sum_ystupki']))}
+
+    # Снимок удерживается до конца отдачи потока
+    data = databases.acquire()
+    rows = json_stream.pooled_rows(data.tender_pool, query, params, tender_record)
+    # json: {"data": [...], "KPI_DIFF_PROC": ..., "discount": ...}; ndjson: строки и итоговая запись последней
+    return json_stream.stream_response(rows, format, key='data' if format == 'json' else None, tail=summary,
+                                       background=BackgroundTask(databases.release, data))
 
 
 @app.get("/competitors")
-async def get_competitors(inn: str = Query(...)):
-    conn = get_db_connection()
-    cursor = conn.cursor()
+async def get_competitors(inn: str = Query(...), data: Snapshot = Depends(databases.dependency)):
+    key = response_cache.key('/competitors', data.version, inn=inn)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
 
     # Запрос для получения списка конкурентов
-    cursor.execute('''
-        SELECT competitor_inn,
-            competitor_name,
-            competitor_region,
-            total_contracts,
-            competitor_wins,
-            supplier_wins,
-            total_contracts - (competitor_wins + supplier_wins) AS other_wins,
-            GROUP_CONCAT(DISTINCT kpgz_info) AS kpgz_info
-    FROM (
-		SELECT 
-            p2.inn AS competitor_inn,
-            f2.firma_name AS competitor_name,
-            f2.firma_region AS competitor_region,
-            kpgz.kpgz_code || ' ' || kpgz.kpgz_name AS kpgz_info,
-            COUNT(DISTINCT ks.ks_id) AS total_contracts,
-            SUM(CASE WHEN p2.inn = ks.winner_inn THEN 1 ELSE 0 END) AS competitor_wins,
-            SUM(CASE WHEN p1.inn = ks.winner_inn THEN 1 ELSE 0 END) AS supplier_wins
-        FROM 
-            participant p1
-        JOIN 
-            participant p2 ON p1.ks_id = p2.ks_id AND p1.inn != p2.inn
-        JOIN 
-            ks ON p1.ks_id = ks.ks_id
-        JOIN 
-            firma f2 ON p2.inn = f2.inn
-        JOIN 
-            kpgz ON ks.kpgz_code = kpgz.kpgz_code
-        WHERE 
-            p1.inn = ?
-        GROUP BY 
-            p2.inn, f2.firma_name, f2.firma_region
-        ORDER BY competitor_wins DESC, total_contracts DESC
-        LIMIT 100
-) AS X
-GROUP BY 1, 2, 3
-ORDER BY competitor_wins DESC, total_contracts DESC
-    ''', (inn,))
-
-    results = cursor.fetchall()
+    results = await data.tender7_db.fetchall(queries.COMPETITORS, (inn,))
+    return response_cache.put(key, JSONResponse(content=competitors_result(results)))
+
 
+def competitors_result(results):
+    """Ответ /competitors по строкам COMPETITORS одного ИНН."""
     # Обработка результатов
     competitors = []
     total_kpi = 0  # Сумма KPI по всем конкурентам
@@ -408,7 +434,107 @@ ORDER BY competitor_wins DESC, total_contracts DESC
             "other_win_percentage": round(other_percentage, 2)
         })
     average_kpi = (total_kpi / total_contracts_all) if total_contracts_all > 0 else 0
-    return JSONResponse(content={"kpi": round(average_kpi, 2), "competitors": competitors})
+    return {"kpi": round(average_kpi, 2), "competitors": competitors}
+
+
+# Пакетные варианты /wins_dots, /contracts_by_years и /competitors: ?inn=...&inn=... (до MAX_BATCH ИНН).
+# Все ИНН считаются одним запросом к каждой таблице (WHERE inn IN (...)) на одном соединении;
+# ответ - {ИНН: ответ одиночного эндпоинта} в порядке запроса
+def batch_inns(inns):
+    if len(inns) > MAX_BATCH:
+        raise HTTPException(status_code=400, detail=f"Не больше {MAX_BATCH} ИНН за запрос")
+    return list(dict.fromkeys(inns))
+
+
+def rows_by_inn(conn, sql, params):
+    """Строки запроса, сгруппированные по колонке inn."""
+    grouped = {}
+    for row in conn.execute(sql, params):
+        grouped.setdefault(row['inn'], []).append(row)
+    return grouped
+
+
+def read_wins_dots_batch(conn, inns, since):
+    inn_set = queries.inn_set(inns)
+    with_wins = {row['inn'] for row in conn.execute(queries.HAS_WINS_BATCH, (inn_set,))}
+    points = rows_by_inn(conn, queries.WINS_DOTS_BATCH, (inn_set, since))
+    return {inn: wins_dots_result(points.get(inn, [])) if inn in with_wins
+            else {"message": "Нет данных для указанного ИНН."} for inn in inns}
+
+
+def read_batch(conn, sql, inns, result):
+    rows = rows_by_inn(conn, sql, (queries.inn_set(inns),))
+    return {inn: result(rows.get(inn, [])) for inn in inns}
+
+
+@app.get("/batch/wins_dots")
+async def get_wins_dots_batch(inn: List[str] = Query(...), data: Snapshot = Depends(databases.dependency)):
+    inns = batch_inns(inn)
+    since = (datetime.now() - timedelta(days=730)).strftime('%Y-%m-%d')  # 2 года = 730 дней
+    key = response_cache.key('/batch/wins_dots', data.version, inns=inns, since=since)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+
+    results = await data.tender7_db.run(read_wins_dots_batch, inns, since)
+    return response_cache.put(key, JSONResponse(content=results))
+
+
+@app.get("/batch/contracts_by_years")
+async def get_contracts_by_years_batch(inn: List[str] = Query(...), data: Snapshot = Depends(databases.dependency)):
+    inns = batch_inns(inn)
+    key = response_cache.key('/batch/contracts_by_years', data.version, inns=inns)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+
+    results = await data.tender7_db.run(read_batch, queries.CONTRACTS_BY_YEARS_BATCH, inns, contracts_by_years_result)
+    return response_cache.put(key, JSONResponse(content=results))
+
+
+@app.get("/batch/competitors")
+async def get_competitors_batch(inn: List[str] = Query(...), data: Snapshot = Depends(databases.dependency)):
+    inns = batch_inns(inn)
+    key = response_cache.key('/batch/competitors', data.version, inns=inns)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+
+    results = await data.tender7_db.run(read_batch, queries.COMPETITORS_BATCH, inns, competitors_result)
+    return response_cache.put(key, JSONResponse(content=results))
+
+
+# Аналитика категории КПГЗ из куба kpgz_cube: prefix - префикс кода ('' - весь рынок), region и month (YYYY-MM)
+# сужают ячейку, без них - итог по всем регионам / месяцам. by - детализация по подкатегориям, регионам или месяцам
+def read_kpgz(conn, prefix, region, month, by, top):
+    cell = conn.execute(queries.KPGZ_CELL, (prefix, region, month)).fetchone()
+    if cell is None:
+        return {"message": "Нет данных для указанной категории."}
+    result = {"category": dict(cell)}
+    if month == rollups.CUBE_ALL:
+        # Победители хранятся за всё время, без разбивки по месяцам
+        result["top_winners"] = [dict(row) for row in conn.execute(queries.KPGZ_TOP_WINNERS, (prefix, region, top))]
+    if by is not None:
+        result[by] = [dict(row) for row in conn.execute(*queries.kpgz_breakdown(by, prefix, region, month))]
+    return result
+
+
+@app.get("/kpgz")
+async def get_kpgz(prefix: str = Query(''),
+                   region: Optional[str] = Query(None),
+                   month: Optional[str] = Query(None, pattern=r'^\d{4}-\d{2}$'),
+                   by: Optional[str] = Query(None, pattern=queries.KPGZ_BREAKDOWN_PATTERN),
+                   top: int = Query(10, ge=0, le=rollups.CUBE_TOP_WINNERS),
+                   data: Snapshot = Depends(databases.dependency)):
+    region = region or rollups.CUBE_ALL
+    month = month or rollups.CUBE_ALL
+    key = response_cache.key('/kpgz', data.version, prefix=prefix, region=region, month=month, by=by, top=top)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+
+    result = await data.tender7_db.run(read_kpgz, prefix, region, month, by, top)
+    return response_cache.put(key, JSONResponse(content=result))
 
 
 if __name__ == "__main__":
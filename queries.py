@@ -0,0 +1,340 @@
+# SQL-запросы эндпоинтов main2.py к нормализованной базе (Tender7.db) и к сырой таблице data (tender.db).
+# Вынесены отдельно, чтобы их планы можно было проверять при импорте (см. import_util.check_query_plans).
+import json
+
+from rollups import CUBE_ALL
+
+FIRMS = "SELECT inn, firma_name AS name, firma_region AS region FROM firma"
+
+# Версия данных, увеличивается каждой загрузкой (import_util.bump_data_version)
+DATA_VERSION = "SELECT value FROM import_meta WHERE key = 'data_version'"
+
+# Размер страницы по умолчанию и максимальный для постраничных эндпоинтов
+PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+
+SESSIONS = '''
+        SELECT ks.ks_id AS id_ks, ks.ks_url, ks.customer_inn, f1.firma_name AS customer_name, 
+               f1.firma_region AS customer_region, ks.fz, ks.start_time, ks.end_time, 
+               ks.start_price, ks.end_price, ks.winner_inn, kpgz.kpgz_code, kpgz.kpgz_name,
+               ks.end_price - ks.start_price as discount_size
+        FROM ks
+        LEFT JOIN firma AS f1 ON ks.customer_inn = f1.inn
+        LEFT JOIN firma AS f2 ON ks.winner_inn = f2.inn
+        LEFT JOIN kpgz ON ks.kpgz_code = kpgz.kpgz_code
+    '''
+
+
+def prefix_range(prefix):
+    """Границы [prefix, следующий за ним) для поиска по префиксу через индекс вместо LIKE 'x%'."""
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def paged(sql, conditions, params, order_by, limit):
+    """Добавляет к запросу WHERE из заданных условий и ORDER BY ... LIMIT для keyset-пагинации."""
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+    return f'{sql}{where} ORDER BY {order_by} LIMIT ?', (*params, limit)
+
+
+def firms_page(after=None, limit=PAGE_SIZE, region=None):
+    """Страница фирм по возрастанию ИНН, начиная после ИНН after."""
+    conditions, params = [], []
+    if after is not None:
+        conditions.append('inn > ?')
+        params.append(after)
+    if region is not None:
+        conditions.append('firma_region = ?')
+        params.append(region)
+    return paged(FIRMS, conditions, params, 'inn', limit)
+
+
+def sessions_page(after=None, limit=PAGE_SIZE, customer_inn=None, winner_inn=None, kpgz_code=None, fz=None,
+                  start_date=None, end_date=None, kpgz_match='prefix'):
+    """Страница КС по возрастанию ks_id, начиная после after; фильтры выполняются в SQL.
+
+    kpgz_match='exact' - только сам код КПГЗ: такие страницы идут по индексу в порядке ks_id,
+    а для префикса подходящие КС сортируются.
+    """
+    conditions, params = [], []
+    if after is not None:
+        conditions.append('ks.ks_id > ?')
+        params.append(after)
+    if customer_inn is not None:
+        conditions.append('ks.customer_inn = ?')
+        params.append(customer_inn)
+    if winner_inn is not None:
+        conditions.append('ks.winner_inn = ?')
+        params.append(winner_inn)
+    if kpgz_code and kpgz_match == 'exact':
+        conditions.append('ks.kpgz_code = ?')
+        params.append(kpgz_code)
+    elif kpgz_code:
+        conditions.append('ks.kpgz_code >= ? AND ks.kpgz_code < ?')
+        params.extend(prefix_range(kpgz_code))
+    if fz is not None:
+        conditions.append('ks.fz = ?')
+        params.append(fz)
+    if start_date is not None:
+        conditions.append('ks.end_time >= ?')
+        params.append(start_date)
+    if end_date is not None:
+        conditions.append('ks.end_time <= ?')
+        params.append(end_date)
+    return paged(SESSIONS, conditions, params, 'ks.ks_id', limit)
+
+
+# Победы по дням из предрасчитанной supplier_daily (см. rollups.py)
+HAS_WINS = "SELECT 1 FROM supplier_daily WHERE inn = ? AND wins > 0 LIMIT 1"
+
+WINS_DOTS = '''
+        SELECT day AS ks_date, start_price_sum AS ks_start_price, end_price_sum AS ks_end_price,
+               discount_sum AS summa_ustupki
+        FROM supplier_daily
+        WHERE inn = ? AND wins > 0 AND day >= ?
+        ORDER BY day
+    '''
+
+CONTRACTS_BY_YEARS = '''
+        SELECT year, participations AS parts_count, wins AS wins_count
+        FROM supplier_yearly
+        WHERE inn = ?
+        ORDER BY year
+    '''
+
+# Конкуренты берутся из предрасчитанной таблицы competitor_pair (см. rollups.py)
+COMPETITORS = '''
+        SELECT cp.competitor_inn,
+               f.firma_name AS competitor_name,
+               f.firma_region AS competitor_region,
+               cp.shared_sessions AS total_contracts,
+               cp.competitor_wins,
+               cp.supplier_wins,
+               cp.shared_sessions - (cp.competitor_wins + cp.supplier_wins) AS other_wins,
+               cp.kpgz_info
+        FROM competitor_pair cp
+        JOIN firma f ON cp.competitor_inn = f.inn
+        WHERE cp.inn = ?
+        ORDER BY cp.competitor_wins DESC, cp.shared_sessions DESC
+        LIMIT 100
+    '''
+
+# Пакетные варианты для списка ИНН (/batch/*): список передаётся одним параметром-массивом JSON,
+# как в rollups._inn_filter, поэтому текст запроса не зависит от числа ИНН. Строки упорядочены по inn
+INN_SET = 'IN (SELECT value FROM json_each(?))'
+
+HAS_WINS_BATCH = f"SELECT inn FROM supplier_daily WHERE inn {INN_SET} AND wins > 0 GROUP BY inn"
+
+WINS_DOTS_BATCH = f'''
+        SELECT inn, day AS ks_date, start_price_sum AS ks_start_price, end_price_sum AS ks_end_price,
+               discount_sum AS summa_ustupki
+        FROM supplier_daily
+        WHERE inn {INN_SET} AND wins > 0 AND day >= ?
+        ORDER BY inn, day
+    '''
+
+CONTRACTS_BY_YEARS_BATCH = f'''
+        SELECT inn, year, participations AS parts_count, wins AS wins_count
+        FROM supplier_yearly
+        WHERE inn {INN_SET}
+        ORDER BY inn, year
+    '''
+
+# Топ-100 конкурентов каждого ИНН, как в COMPETITORS
+COMPETITORS_BATCH = f'''
+        SELECT * FROM (
+            SELECT cp.inn,
+                   cp.competitor_inn,
+                   f.firma_name AS competitor_name,
+                   f.firma_region AS competitor_region,
+                   cp.shared_sessions AS total_contracts,
+                   cp.competitor_wins,
+                   cp.supplier_wins,
+                   cp.shared_sessions - (cp.competitor_wins + cp.supplier_wins) AS other_wins,
+                   cp.kpgz_info,
+                   ROW_NUMBER() OVER (PARTITION BY cp.inn
+                                      ORDER BY cp.competitor_wins DESC, cp.shared_sessions DESC) AS position
+            FROM competitor_pair cp
+            JOIN firma f ON cp.competitor_inn = f.inn
+            WHERE cp.inn {INN_SET}
+        )
+        WHERE position <= 100
+        ORDER BY inn, position
+    '''
+
+
+def inn_set(inns):
+    """Параметр для INN_SET."""
+    return json.dumps(list(inns))
+
+
+# Аналитика категорий КПГЗ (/kpgz) из куба kpgz_cube (см. rollups.rebuild_kpgz_cube).
+# Регион и месяц CUBE_ALL - итог по всем регионам / месяцам
+KPGZ_CELL_COLUMNS = '''c.kpgz_prefix, k.kpgz_name, c.region, c.month, c.sessions,
+               c.end_price_sum AS total_value, c.start_price_sum, c.discount_sum,
+               ROUND(c.discount_sum * 100.0 / NULLIF(c.start_price_sum, 0), 2) AS average_discount_percentage,
+               c.suppliers, c.winners
+        FROM kpgz_cube c
+        LEFT JOIN kpgz k ON k.kpgz_code = c.kpgz_prefix'''
+
+KPGZ_CELL = f"SELECT {KPGZ_CELL_COLUMNS} WHERE c.kpgz_prefix = ? AND c.region = ? AND c.month = ?"
+
+# Детализация ячейки: по подкатегориям, по регионам или по месяцам
+KPGZ_BREAKDOWNS = {
+    'children': f'''SELECT {KPGZ_CELL_COLUMNS}
+        WHERE c.parent_prefix = ? AND c.region = ? AND c.month = ?
+        ORDER BY c.end_price_sum DESC''',
+    'region': f'''SELECT {KPGZ_CELL_COLUMNS}
+        WHERE c.kpgz_prefix = ? AND c.region != ? AND c.month = ?
+        ORDER BY c.end_price_sum DESC''',
+    'month': f'''SELECT {KPGZ_CELL_COLUMNS}
+        WHERE c.kpgz_prefix = ? AND c.region = ? AND c.month != ?
+        ORDER BY c.month''',
+}
+KPGZ_BREAKDOWN_PATTERN = f"^({'|'.join(KPGZ_BREAKDOWNS)})$"
+
+KPGZ_TOP_WINNERS = '''
+        SELECT w.position, w.winner_inn, f.firma_name AS winner_name, f.firma_region AS winner_region,
+               w.wins, w.end_price_sum AS total_value
+        FROM kpgz_cube_winner w
+        LEFT JOIN firma f ON f.inn = w.winner_inn
+        WHERE w.kpgz_prefix = ? AND w.region = ?
+        ORDER BY w.position
+        LIMIT ?
+    '''
+
+
+def kpgz_breakdown(by, prefix, region=CUBE_ALL, month=CUBE_ALL):
+    """Запрос детализации by (ключ KPGZ_BREAKDOWNS) ячейки куба и параметры к нему."""
+    params = {'children': (prefix, region, month),
+              'region': (prefix, CUBE_ALL, month),
+              'month': (prefix, region, CUBE_ALL)}[by]
+    return KPGZ_BREAKDOWNS[by], params
+
+
+# Ряды для /series/*: время в unix epoch и значение, прореживаются в series.downsample.
+# Все победы ИНН читаются из покрывающего индекса idx_ks_winner
+WINS_SERIES = '''
+        SELECT CAST(strftime('%s', end_time) AS INTEGER) AS ts, end_price AS value
+        FROM ks
+        WHERE winner_inn = ? AND end_time IS NOT NULL AND end_price IS NOT NULL
+    '''
+
+# Показатели supplier_daily, доступные как ряды
+DAILY_METRICS = {
+    'participations': 'participations',
+    'wins': 'wins',
+    'start_price': 'start_price_sum',
+    'end_price': 'end_price_sum',
+    'discount': 'discount_sum',
+}
+DAILY_METRIC_PATTERN = f"^({'|'.join(DAILY_METRICS)})$"
+
+
+def daily_series(metric):
+    """Дневной ряд показателя metric (ключ DAILY_METRICS) из supplier_daily; параметры (inn,)."""
+    return f'''
+        SELECT CAST(strftime('%s', day) AS INTEGER) AS ts, {DAILY_METRICS[metric]} AS value
+        FROM supplier_daily
+        WHERE inn = ?
+    '''
+
+
+# Запросы эндпоинтов и пример параметров для EXPLAIN QUERY PLAN.
+# Для /inns и /sessions проверяются следующие страницы: первая читается с начала таблицы до LIMIT.
+ENDPOINT_QUERIES = {
+    '/inns': firms_page(after='0'),
+    '/sessions': sessions_page(after=0),
+    # Первые страницы с фильтром (без cursor): фильтр должен идти по индексу, а не обходом всего индекса
+    '/inns?region': firms_page(region='0'),
+    '/sessions?customer_inn': sessions_page(customer_inn='0'),
+    '/sessions?winner_inn': sessions_page(winner_inn='0'),
+    '/sessions?kpgz_code': sessions_page(kpgz_code='01'),
+    '/sessions?kpgz_code&kpgz_match=exact': sessions_page(kpgz_code='01.02.03', kpgz_match='exact'),
+    '/sessions?start_date&end_date': sessions_page(start_date='2024-01-01', end_date='2024-12-31'),
+    '/wins_dots': (WINS_DOTS, ('0', '2000-01-01')),
+    '/contracts_by_years': (CONTRACTS_BY_YEARS, ('0',)),
+    '/competitors': (COMPETITORS, ('0',)),
+    '/series/wins': (WINS_SERIES, ('0',)),
+    '/series/daily': (daily_series('end_price'), ('0',)),
+    '/batch/wins_dots': (WINS_DOTS_BATCH, (inn_set(['0', '1']), '2000-01-01')),
+    '/batch/wins_dots?has_wins': (HAS_WINS_BATCH, (inn_set(['0', '1']),)),
+    '/batch/contracts_by_years': (CONTRACTS_BY_YEARS_BATCH, (inn_set(['0', '1']),)),
+    '/batch/competitors': (COMPETITORS_BATCH, (inn_set(['0', '1']),)),
+    '/kpgz': (KPGZ_CELL, ('01', CUBE_ALL, CUBE_ALL)),
+    '/kpgz?by=children': kpgz_breakdown('children', '01'),
+    '/kpgz?by=region': kpgz_breakdown('region', '01'),
+    '/kpgz?by=month': kpgz_breakdown('month', '01'),
+    '/kpgz?top_winners': (KPGZ_TOP_WINNERS, ('01', CUBE_ALL, 10)),
+}
+
+
+# /customers/config/ по сырой таблице data (tender.db).
+# Цены в data хранятся текстом с табуляциями и неразрывными пробелами; очищенные числа и время
+# в unix epoch лежат в индексированных колонках start_price_num, end_price_num, start_ts и end_ts,
+# которые заполняет import_util.migrate_raw_data по этим выражениям.
+END_PRICE = '''CAST(TRIM(REPLACE(REPLACE(data."Конечная цена КС (победителя в КС)", CHAR(9), ''), CHAR(160), '')) AS FLOAT)'''
+START_PRICE = '''CAST(TRIM(REPLACE(REPLACE(data."Начальная цена КС", CHAR(9), ''), CHAR(160), '')) AS FLOAT)'''
+
+TENDERS = '''SELECT
+        DISTINCT data."Id КС",
+        data.end_price_num AS "Конечная цена КС (победителя в КС)",
+        data.start_price_num AS "Начальная цена КС",
+        data."Ссылка на КС", data."ИНН заказчика", data."Наименование заказчика", data."Регион заказчика",
+        data."Начало КС", data."Окончание КС", data."ИНН победителя КС", data."Наименование победителя КС",
+        data."Регион победителя КС", data."Участники КС - поставщики", data."Код КПГЗ", data."Наименование КПГЗ",
+        {do} AS "do"
+    FROM data'''
+
+
+def tenders_query(kpgz_code=None, winner_region=None, start_date=None, end_date=None, inn=None, do=None,
+                  min_price=None, max_price=None, customers=None, win=None):
+    """Параметризованный запрос для /customers/config/.
+
+    В WHERE попадают только заданные фильтры, значения передаются параметрами, поэтому текст
+    запроса зависит лишь от набора фильтров и переиспользуется кэшем подготовленных выражений sqlite3.
+    """
+    # do - участвовал ли inn в КС: точный поиск по индексу data_participant (см. import_util.build_raw_participants)
+    params = []
+    if inn is not None:
+        do_expression = '''CASE WHEN EXISTS (SELECT 1 FROM data_participant dp
+                                         WHERE dp.inn = ? AND dp.ks_id = data."Id КС")
+                           THEN 'true' ELSE 'false' END'''
+        params.append(inn)
+    else:
+        do_expression = "'false'"
+
+    conditions = []
+    if kpgz_code:
+        conditions.append('data."Код КПГЗ" >= ? AND data."Код КПГЗ" < ?')
+        params.extend(prefix_range(kpgz_code))
+    if winner_region is not None:
+        conditions.append('data."Регион победителя КС" = ?')
+        params.append(winner_region)
+    if start_date is not None:
+        conditions.append("data.end_ts >= CAST(strftime('%s', ?) AS INTEGER)")
+        params.append(start_date)
+    if end_date is not None:
+        conditions.append("data.end_ts <= CAST(strftime('%s', ?) AS INTEGER)")
+        params.append(end_date)
+    if win is not None:
+        conditions.append('data."ИНН победителя КС" = ?')
+        params.append(inn)
+    if min_price is not None:
+        conditions.append('data.end_price_num > ?')
+        params.append(float(min_price))
+    if max_price is not None:
+        conditions.append('data.end_price_num < ?')
+        params.append(float(max_price))
+    if customers is not None:
+        conditions.append('data."ИНН заказчика" = ?')
+        params.append(customers)
+    if do is not None and inn is not None:
+        membership = 'IN' if do == 'true' else 'NOT IN'
+        conditions.append(f'data."Id КС" {membership} (SELECT ks_id FROM data_participant WHERE inn = ?)')
+        params.append(inn)
+    elif do is not None:
+        conditions.append('"do" = ?')
+        params.append(do)
+
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+    return f'{TENDERS.format(do=do_expression)}{where} GROUP BY data."Id КС"', tuple(params)
@@ -0,0 +1,154 @@
+# Кэш ответов эндпоинтов, зависящих только от параметров запроса и версии данных.
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi.responses import JSONResponse, Response
+
+# Записей в памяти процесса и время жизни записи, секунды
+CACHE_SIZE = 1024
+CACHE_TTL = 600
+# Потоковые ответы больше этого размера не кэшируются
+MAX_BODY_BYTES = 4 * 1024 * 1024
+# Заголовки, которые Response выставит сам
+_SKIPPED_HEADERS = ('content-length', 'content-type')
+
+
+class CachedResponse:
+    __slots__ = ('body', 'status_code', 'media_type', 'headers', 'expires')
+
+    def __init__(self, body, status_code, media_type, headers, expires):
+        self.body = body
+        self.status_code = status_code
+        self.media_type = media_type
+        self.headers = headers
+        self.expires = expires
+
+    def response(self):
+        return Response(self.body, self.status_code, self.headers, self.media_type)
+
+
+class ResponseCache:
+    """Двухуровневый кэш готовых ответов: LRU с TTL в памяти процесса и, если задан disk_path,
+    общая для всех процессов таблица SQLite.
+
+    Ключ - эндпоинт, параметры и версия данных, поэтому после загрузки новых данных старые записи
+    не используются; clear() (вызывается при перезагрузке снимка) освобождает их сразу.
+    """
+
+    def __init__(self, size=CACHE_SIZE, ttl=CACHE_TTL, disk_path=None):
+        self.size = size
+        self.ttl = ttl
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        self._disk = None
+        if disk_path is not None:
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False, isolation_level=None)
+            self._disk.execute('PRAGMA journal_mode = WAL')
+            self._disk.execute('''
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    key TEXT PRIMARY KEY,
+                    version TEXT,
+                    expires REAL,
+                    status_code INTEGER,
+                    media_type TEXT,
+                    headers TEXT,
+                    body BLOB
+                )
+            ''')
+
+    @staticmethod
+    def key(endpoint, version, **params):
+        return json.dumps([str(version), endpoint, sorted(params.items())], ensure_ascii=False, default=str)
+
+    @staticmethod
+    def _version(key):
+        return json.loads(key)[0]
+
+    def get(self, key):
+        """Готовый Response из кэша или None."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry.expires > now:
+                self._memory.move_to_end(key)
+                self.stats['hits'] += 1
+                return entry.response()
+            if entry is not None:
+                del self._memory[key]
+            if self._disk is not None:
+                row = self._disk.execute('SELECT body, status_code, media_type, headers, expires '
+                                         'FROM response_cache WHERE key = ? AND expires > ?', (key, now)).fetchone()
+                if row is not None:
+                    entry = CachedResponse(row[0], row[1], row[2], json.loads(row[3]), row[4])
+                    self._remember(key, entry)
+                    self.stats['disk_hits'] += 1
+                    return entry.response()
+            self.stats['misses'] += 1
+        return None
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.size:
+            self._memory.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def _store(self, key, body, status_code, media_type, headers):
+        if status_code != 200:
+            return
+        headers = {name: value for name, value in headers.items() if name not in _SKIPPED_HEADERS}
+        entry = CachedResponse(bytes(body), status_code, media_type, headers, time.time() + self.ttl)
+        with self._lock:
+            self._remember(key, entry)
+            self.stats['stores'] += 1
+            if self._disk is not None:
+                self._disk.execute('INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                   (key, self._version(key), entry.expires, status_code, media_type,
+                                    json.dumps(headers), entry.body))
+
+    def put(self, key, response):
+        """Кэширует ответ (Response или то, что FastAPI отдал бы как JSON) и возвращает его как Response."""
+        if not isinstance(response, Response):
+            response = JSONResponse(content=response)
+        self._store(key, response.body, response.status_code, response.media_type, response.headers)
+        return response
+
+    def stream(self, key, response):
+        """Оборачивает StreamingResponse: тело кэшируется по мере отдачи, если уложилось в MAX_BODY_BYTES."""
+        body_iterator = response.body_iterator
+
+        async def tee():
+            parts, size = [], 0
+            async for chunk in body_iterator:
+                if parts is not None:
+                    parts.append(chunk.encode() if isinstance(chunk, str) else chunk)
+                    size += len(parts[-1])
+                    if size > MAX_BODY_BYTES:
+                        parts = None
+                yield chunk
+            if parts is not None:
+                self._store(key, b''.join(parts), response.status_code, response.media_type, response.headers)
+
+        response.body_iterator = tee()
+        return response
+
+    def clear(self, version=None):
+        """Удаляет записи из памяти; на диске - записи других версий (или все, если version не задана)."""
+        with self._lock:
+            self._memory.clear()
+            if self._disk is not None:
+                if version is None:
+                    self._disk.execute('DELETE FROM response_cache')
+                else:
+                    self._disk.execute('DELETE FROM response_cache WHERE version != ? OR expires <= ?',
+                                       (str(version), time.time()))
+
+    def metrics(self):
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['disk_hits'] + self.stats['misses']
+            return {**self.stats, 'entries': len(self._memory),
+                    'hit_rate': round((self.stats['hits'] + self.stats['disk_hits']) / lookups, 4) if lookups else 0}
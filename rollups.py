@@ -0,0 +1,371 @@
+# Предрасчитанные агрегаты для эндпоинтов main2.py.
+# Полностью строятся при загрузке (import_util) и точечно обновляются при инкрементальном импорте.
+import json
+
+# Куб категорий KPGZ: значение региона и месяца в строках-итогах по всем регионам / месяцам
+CUBE_ALL = '*'
+# Сколько крупнейших победителей хранится на ячейку (префикс КПГЗ, регион)
+CUBE_TOP_WINNERS = 20
+# Таблицы агрегатов, которые заполняет refresh_rollups
+ROLLUP_TABLES = ('competitor_pair', 'supplier_daily', 'supplier_yearly', 'kpgz_cube')
+
+
+def create_rollup_tables(conn):
+    """Создаёт таблицы агрегатов, если их нет. Коммит - на вызывающем: вызывается и внутри транзакции загрузки."""
+    cursor = conn.cursor()
+
+    # Пары конкурентов: inn и competitor_inn участвовали в shared_sessions общих КС
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS competitor_pair (
+            inn TEXT,
+            competitor_inn TEXT,
+            shared_sessions INTEGER,
+            supplier_wins INTEGER,
+            competitor_wins INTEGER,
+            kpgz_info TEXT,
+            PRIMARY KEY (inn, competitor_inn)
+        )
+    ''')
+    # /competitors: топ конкурентов по победам одним проходом по индексу
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_competitor_pair_top
+        ON competitor_pair (inn, competitor_wins DESC, shared_sessions DESC)
+    ''')
+
+    # Статистика поставщика по дням окончания КС (/wins_dots) и по годам начала КС (/contracts_by_years).
+    # participations - участия в КС, wins - победы; суммы цен и уступки - по выигранным КС.
+    for table, period in (('supplier_daily', 'day'), ('supplier_yearly', 'year')):
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                inn TEXT,
+                {period} TEXT,
+                participations INTEGER,
+                wins INTEGER,
+                start_price_sum REAL,
+                end_price_sum REAL,
+                discount_sum REAL,
+                PRIMARY KEY (inn, {period})
+            )
+        ''')
+
+    # Куб категорий: префикс кода КПГЗ ('' - весь рынок, '01', '01.05', '01.05.01') x регион заказчика
+    # x месяц окончания КС, с итогами по всем регионам и месяцам (CUBE_ALL).
+    # Суммы цен и уступки, число КС, различных участников и победителей
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS kpgz_cube (
+            kpgz_prefix TEXT,
+            region TEXT,
+            month TEXT,
+            parent_prefix TEXT,
+            sessions INTEGER,
+            start_price_sum REAL,
+            end_price_sum REAL,
+            discount_sum REAL,
+            suppliers INTEGER,
+            winners INTEGER,
+            PRIMARY KEY (kpgz_prefix, region, month)
+        ) WITHOUT ROWID
+    ''')
+    # Переход к подкатегориям: строки с заданным родительским префиксом
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_kpgz_cube_parent
+        ON kpgz_cube (parent_prefix, region, month)
+    ''')
+    # Крупнейшие победители ячейки (префикс, регион) за всё время, position - место по сумме побед
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS kpgz_cube_winner (
+            kpgz_prefix TEXT,
+            region TEXT,
+            position INTEGER,
+            winner_inn TEXT,
+            wins INTEGER,
+            end_price_sum REAL,
+            PRIMARY KEY (kpgz_prefix, region, position)
+        ) WITHOUT ROWID
+    ''')
+    # Отметки инкрементальной загрузки (mark_sessions), ждущие пересчёта агрегатов. Пишутся в одной
+    # транзакции с изменёнными КС, поэтому переживают промежуточные коммиты и прерванную загрузку.
+    # ИНН участников и победителей
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rollup_dirty_inn (
+            inn TEXT PRIMARY KEY
+        ) WITHOUT ROWID
+    ''')
+    # Ячейки куба (код КПГЗ, регион, месяц)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS kpgz_cube_dirty (
+            kpgz_code TEXT,
+            region TEXT,
+            month TEXT,
+            PRIMARY KEY (kpgz_code, region, month)
+        ) WITHOUT ROWID
+    ''')
+
+
+def _inn_filter(column, inns):
+    """Условие на подмножество ИНН (None - все) и параметры к нему."""
+    if inns is None:
+        return '', ()
+    return f'WHERE {column} IN (SELECT value FROM json_each(?))', (json.dumps(sorted(inns)),)
+
+
+def rebuild_competitor_pairs(conn, inns=None):
+    """Пересчитывает competitor_pair для указанных ИНН (None - целиком)."""
+    where, params = _inn_filter('inn', inns)
+    conn.execute(f'DELETE FROM competitor_pair {where}', params)
+    where, params = _inn_filter('p1.inn', inns)
+    conn.execute(f'''
+        INSERT INTO competitor_pair (inn, competitor_inn, shared_sessions, supplier_wins, competitor_wins, kpgz_info)
+        SELECT p1.inn,
+               p2.inn,
+               COUNT(*),
+               SUM(CASE WHEN p1.inn = ks.winner_inn THEN 1 ELSE 0 END),
+               SUM(CASE WHEN p2.inn = ks.winner_inn THEN 1 ELSE 0 END),
+               GROUP_CONCAT(DISTINCT kpgz.kpgz_code || ' ' || kpgz.kpgz_name)
+        FROM participant p1
+        JOIN participant p2 ON p1.ks_id = p2.ks_id AND p1.inn != p2.inn
+        JOIN ks ON p1.ks_id = ks.ks_id
+        LEFT JOIN kpgz ON ks.kpgz_code = kpgz.kpgz_code
+        {where}
+        GROUP BY p1.inn, p2.inn
+    ''', params)
+
+
+def rebuild_supplier_stats(conn, inns=None):
+    """Пересчитывает supplier_daily и supplier_yearly для указанных ИНН (None - целиком)."""
+    where, params = _inn_filter('inn', inns)
+    conn.execute(f'DELETE FROM supplier_daily {where}', params)
+    conn.execute(f'DELETE FROM supplier_yearly {where}', params)
+
+    # По дням: победы считаются по ks.winner_inn, как в /wins_dots
+    participant_where, participant_params = _inn_filter('p.inn', inns)
+    winner_where, winner_params = _inn_filter('ks.winner_inn', inns)
+    conn.execute(f'''
+        INSERT INTO supplier_daily (inn, day, participations, wins, start_price_sum, end_price_sum, discount_sum)
+        SELECT inn, day, SUM(participations), SUM(wins), SUM(start_price), SUM(end_price), SUM(discount)
+        FROM (
+            SELECT p.inn, date(ks.end_time) AS day, 1 AS participations, 0 AS wins,
+                   0 AS start_price, 0 AS end_price, 0 AS discount
+            FROM participant p
+            JOIN ks ON p.ks_id = ks.ks_id
+            {participant_where}
+            UNION ALL
+            SELECT ks.winner_inn, date(ks.end_time), 0, 1,
+                   ks.start_price, ks.end_price, ks.start_price - ks.end_price
+            FROM ks
+            {winner_where}
+        )
+        WHERE day IS NOT NULL
+        GROUP BY inn, day
+    ''', participant_params + winner_params)
+
+    # По годам: победы среди КС, где поставщик участвовал, как в /contracts_by_years
+    conn.execute(f'''
+        INSERT INTO supplier_yearly (inn, year, participations, wins, start_price_sum, end_price_sum, discount_sum)
+        SELECT p.inn,
+               strftime('%Y', ks.start_time) AS year,
+               COUNT(*),
+               SUM(CASE WHEN ks.winner_inn = p.inn THEN 1 ELSE 0 END),
+               SUM(CASE WHEN ks.winner_inn = p.inn THEN ks.start_price ELSE 0 END),
+               SUM(CASE WHEN ks.winner_inn = p.inn THEN ks.end_price ELSE 0 END),
+               SUM(CASE WHEN ks.winner_inn = p.inn THEN ks.start_price - ks.end_price ELSE 0 END)
+        FROM participant p
+        JOIN ks ON p.ks_id = ks.ks_id
+        {participant_where}
+        GROUP BY p.inn, year
+    ''', participant_params)
+
+
+# Префиксы кодов КПГЗ из запроса codes ('' - весь рынок): разбор кода по точкам рекурсивным CTE
+_PREFIXES = '''
+    WITH RECURSIVE prefixes(kpgz_code, prefix, parent, rest) AS (
+        SELECT kpgz_code, '', NULL, kpgz_code || '.'
+        FROM ({codes})
+        UNION ALL
+        SELECT kpgz_code,
+               prefix || CASE WHEN prefix = '' THEN '' ELSE '.' END || substr(rest, 1, instr(rest, '.') - 1),
+               prefix,
+               substr(rest, instr(rest, '.') + 1)
+        FROM prefixes
+        WHERE rest != ''
+    )
+'''
+
+
+def mark_sessions(conn, ks_ids):
+    """Отмечает агрегаты, которые затронет изменение указанных КС: ИНН их участников и победителей
+    (rollup_dirty_inn) и ячейки куба КПГЗ (kpgz_cube_dirty). Вызывается до и после записи КС.
+    """
+    ids = json.dumps(sorted(ks_ids))
+    conn.execute('''
+        INSERT OR IGNORE INTO rollup_dirty_inn (inn)
+        SELECT inn FROM participant WHERE ks_id IN (SELECT value FROM json_each(?))
+        UNION
+        SELECT winner_inn FROM ks WHERE ks_id IN (SELECT value FROM json_each(?)) AND winner_inn IS NOT NULL
+    ''', (ids, ids))
+    conn.execute('''
+        INSERT OR IGNORE INTO kpgz_cube_dirty (kpgz_code, region, month)
+        SELECT DISTINCT ks.kpgz_code,
+               COALESCE(f.firma_region, ''),
+               COALESCE(strftime('%Y-%m', ks.end_time), '')
+        FROM ks
+        LEFT JOIN firma f ON ks.customer_inn = f.inn
+        WHERE ks.ks_id IN (SELECT value FROM json_each(?)) AND ks.kpgz_code IS NOT NULL AND ks.kpgz_code != ''
+    ''', (ids,))
+
+
+def has_pending(conn):
+    """Есть ли отметки mark_sessions, ещё не учтённые в агрегатах."""
+    return any(conn.execute(f'SELECT 1 FROM {table} LIMIT 1').fetchone()
+               for table in ('rollup_dirty_inn', 'kpgz_cube_dirty'))
+
+
+def is_missing(conn):
+    """Загружены ли КС, по которым пуста хотя бы одна таблица агрегатов (база старше агрегатов)."""
+    if conn.execute('SELECT 1 FROM ks LIMIT 1').fetchone() is None:
+        return False
+    return any(conn.execute(f'SELECT 1 FROM {table} LIMIT 1').fetchone() is None for table in ROLLUP_TABLES)
+
+
+def _fill_kpgz_cube(conn, dirty):
+    """Считает строки kpgz_cube и kpgz_cube_winner по фактам temp.kpgz_fact.
+
+    dirty - только ключи из temp.kpgz_dirty_key (строки по ним должны быть уже удалены), иначе - все.
+    """
+    # Все сочетания детализации: регион и месяц, только регион, только месяц, итог по префиксу
+    for region, month in (('region', 'month'), ('region', '?'), ('?', 'month'), ('?', '?')):
+        params = [CUBE_ALL] * (region, month).count('?')
+        where = f'''
+            WHERE (f.prefix, {region}, {month}) IN (SELECT prefix, region, month FROM temp.kpgz_dirty_key)
+        ''' if dirty else ''
+        conn.execute(f'''
+            INSERT INTO kpgz_cube (kpgz_prefix, region, month, parent_prefix, sessions, start_price_sum,
+                                   end_price_sum, discount_sum, suppliers, winners)
+            SELECT s.prefix, s.region, s.month, s.parent, s.sessions, s.start_price_sum, s.end_price_sum,
+                   s.discount_sum, COALESCE(p.suppliers, 0), s.winners
+            FROM (
+                SELECT prefix, {region} AS region, {month} AS month, parent,
+                       COUNT(*) AS sessions, SUM(start_price) AS start_price_sum, SUM(end_price) AS end_price_sum,
+                       SUM(start_price - end_price) AS discount_sum, COUNT(DISTINCT winner_inn) AS winners
+                FROM kpgz_fact f
+                {where}
+                GROUP BY 1, 2, 3
+            ) s
+            LEFT JOIN (
+                SELECT f.prefix, {region} AS region, {month} AS month, COUNT(DISTINCT p.inn) AS suppliers
+                FROM kpgz_fact f
+                JOIN participant p ON p.ks_id = f.ks_id
+                {where}
+                GROUP BY 1, 2, 3
+            ) p ON p.prefix = s.prefix AND p.region = s.region AND p.month = s.month
+        ''', params * (4 if dirty else 2))
+
+    # Крупнейшие победители по сумме побед: по регионам и по всему рынку
+    for region in ('region', '?'):
+        params = [CUBE_ALL] if region == '?' else []
+        where = f'''
+            AND (prefix, {region}) IN (SELECT prefix, region FROM temp.kpgz_dirty_key WHERE month = ?)
+        ''' if dirty else ''
+        conn.execute(f'''
+            INSERT INTO kpgz_cube_winner (kpgz_prefix, region, position, winner_inn, wins, end_price_sum)
+            SELECT prefix, region, position, winner_inn, wins, end_price_sum
+            FROM (
+                SELECT prefix, region, winner_inn, wins, end_price_sum,
+                       ROW_NUMBER() OVER (PARTITION BY prefix, region
+                                          ORDER BY end_price_sum DESC, wins DESC, winner_inn) AS position
+                FROM (
+                    SELECT prefix, {region} AS region, winner_inn, COUNT(*) AS wins, SUM(end_price) AS end_price_sum
+                    FROM kpgz_fact
+                    WHERE winner_inn IS NOT NULL {where}
+                    GROUP BY 1, 2, 3
+                )
+            )
+            WHERE position <= ?
+        ''', params + (params + [CUBE_ALL] if dirty else []) + [CUBE_TOP_WINNERS])
+
+
+def _create_kpgz_fact(conn, prefix_filter=''):
+    """temp.kpgz_fact: КС по каждому префиксу своего кода КПГЗ (prefix_filter - условие на префиксы)."""
+    conn.execute('DROP TABLE IF EXISTS temp.kpgz_fact')
+    codes = "SELECT DISTINCT kpgz_code FROM ks WHERE kpgz_code IS NOT NULL AND kpgz_code != ''"
+    conn.execute(f'''
+        CREATE TEMP TABLE kpgz_fact AS
+        {_PREFIXES.format(codes=codes)}
+        SELECT p.prefix, p.parent, ks.ks_id, ks.winner_inn, ks.start_price, ks.end_price,
+               COALESCE(f.firma_region, '') AS region,
+               COALESCE(strftime('%Y-%m', ks.end_time), '') AS month
+        FROM prefixes p
+        JOIN ks ON ks.kpgz_code = p.kpgz_code
+        LEFT JOIN firma f ON ks.customer_inn = f.inn
+        {prefix_filter}
+    ''')
+    conn.execute('CREATE INDEX temp.idx_kpgz_fact_ks ON kpgz_fact (ks_id)')
+
+
+def rebuild_kpgz_cube(conn):
+    """Перестраивает kpgz_cube и kpgz_cube_winner целиком (агрегаты по всему рынку, а не по ИНН)."""
+    conn.execute('DELETE FROM kpgz_cube')
+    conn.execute('DELETE FROM kpgz_cube_winner')
+    conn.execute('DELETE FROM kpgz_cube_dirty')
+    _create_kpgz_fact(conn)
+    _fill_kpgz_cube(conn, dirty=False)
+    conn.execute('DROP TABLE temp.kpgz_fact')
+
+
+def refresh_kpgz_cube(conn):
+    """Пересчитывает строки куба, затронутые ячейками из kpgz_cube_dirty, и очищает её.
+
+    Ячейка (код, регион, месяц) затрагивает по каждому префиксу кода строки (регион, месяц),
+    (регион, все), (все, месяц) и (все, все). Итоги верхних уровней по-прежнему сканируют свой
+    срез фактов, но остальной куб не трогается. Смену региона заказчика в firma без изменения
+    его КС учитывает только полная перестройка.
+    """
+    if conn.execute('SELECT 1 FROM kpgz_cube_dirty LIMIT 1').fetchone() is None:
+        return
+    conn.execute('DROP TABLE IF EXISTS temp.kpgz_dirty_key')
+    codes = 'SELECT DISTINCT kpgz_code FROM kpgz_cube_dirty'
+    conn.execute(f'''
+        CREATE TEMP TABLE kpgz_dirty_key AS
+        {_PREFIXES.format(codes=codes)}
+        SELECT DISTINCT p.prefix, c.region, c.month
+        FROM prefixes p
+        JOIN (
+            SELECT kpgz_code, region, month FROM kpgz_cube_dirty
+            UNION SELECT kpgz_code, region, ? FROM kpgz_cube_dirty
+            UNION SELECT kpgz_code, ?, month FROM kpgz_cube_dirty
+            UNION SELECT kpgz_code, ?, ? FROM kpgz_cube_dirty
+        ) c ON c.kpgz_code = p.kpgz_code
+    ''', [CUBE_ALL] * 4)
+    conn.execute('CREATE INDEX temp.idx_kpgz_dirty_key ON kpgz_dirty_key (prefix, region, month)')
+
+    conn.execute('''
+        DELETE FROM kpgz_cube
+        WHERE (kpgz_prefix, region, month) IN (SELECT prefix, region, month FROM temp.kpgz_dirty_key)
+    ''')
+    conn.execute('''
+        DELETE FROM kpgz_cube_winner
+        WHERE (kpgz_prefix, region) IN (SELECT prefix, region FROM temp.kpgz_dirty_key WHERE month = ?)
+    ''', (CUBE_ALL,))
+    # Факты нужны только по затронутым префиксам; по каждому из них есть ключ (все, все)
+    _create_kpgz_fact(conn, 'WHERE p.prefix IN (SELECT prefix FROM temp.kpgz_dirty_key)')
+    _fill_kpgz_cube(conn, dirty=True)
+    conn.execute('DROP TABLE temp.kpgz_fact')
+    conn.execute('DROP TABLE temp.kpgz_dirty_key')
+    conn.execute('DELETE FROM kpgz_cube_dirty')
+
+
+def refresh_rollups(conn, incremental=False):
+    """Обновляет все агрегаты. Коммит - на вызывающем.
+
+    incremental=False - полная перестройка; иначе пересчитываются только ИНН и ячейки куба КПГЗ,
+    отмеченные mark_sessions, после чего отметки очищаются.
+    """
+    create_rollup_tables(conn)
+    inns = {row[0] for row in conn.execute('SELECT inn FROM rollup_dirty_inn')} if incremental else None
+    rebuild_competitor_pairs(conn, inns)
+    rebuild_supplier_stats(conn, inns)
+    conn.execute('DELETE FROM rollup_dirty_inn')
+    if incremental:
+        refresh_kpgz_cube(conn)
+    else:
+        rebuild_kpgz_cube(conn)
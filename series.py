@@ -0,0 +1,82 @@
+# Прореживание временных рядов для графиков на стороне клиента: вместо картинки или всех точек
+# отдаются колонки dates/values не длиннее запрошенного числа точек (порядка ширины графика в пикселях).
+import numpy as np
+
+# Точек по умолчанию и максимум на один ряд
+DEFAULT_POINTS = 500
+MAX_POINTS = 5000
+
+METHODS = ('lttb', 'bucket')
+METHOD_PATTERN = '^(lttb|bucket)$'
+AGGREGATES = ('sum', 'mean', 'max')
+AGGREGATE_PATTERN = '^(sum|mean|max)$'
+
+
+def lttb(x, y, points):
+    """Индексы точек, отобранных Largest-Triangle-Three-Buckets: форма ряда сохраняется, выбросы не теряются.
+
+    x должен быть отсортирован по возрастанию. Первая и последняя точки всегда входят в результат.
+    """
+    n = len(x)
+    if points >= n or points < 3:
+        return np.arange(n)
+    # Границы points - 2 корзин для внутренних точек; каждая корзина непуста, т.к. n - 2 >= points - 2
+    edges = np.linspace(1, n - 1, points - 1).astype(np.intp)
+    selected = np.empty(points, dtype=np.intp)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for i in range(points - 2):
+        start, stop = edges[i], edges[i + 1]
+        # Вершина треугольника в следующей корзине - её среднее (для последней корзины - последняя точка)
+        next_stop = edges[i + 2] if i + 2 < len(edges) else n
+        next_x, next_y = x[stop:next_stop].mean(), y[stop:next_stop].mean()
+        area = np.abs((x[previous] - next_x) * (y[start:stop] - y[previous])
+                      - (x[previous] - x[start:stop]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(area))
+        selected[i + 1] = previous
+    return selected
+
+
+def time_buckets(x, y, buckets, aggregate='sum'):
+    """Агрегирует y по buckets равным интервалам x. Возвращает начала, значения и число точек непустых интервалов."""
+    low, high = x.min(), x.max()
+    width = (high - low) / buckets or 1
+    index = np.minimum(((x - low) / width).astype(np.intp), buckets - 1)
+    counts = np.bincount(index, minlength=buckets)
+    if aggregate == 'max':
+        values = np.full(buckets, -np.inf)
+        np.maximum.at(values, index, y)
+    else:
+        values = np.bincount(index, weights=y, minlength=buckets)
+        if aggregate == 'mean':
+            values = np.divide(values, counts, out=np.zeros(buckets), where=counts > 0)
+    keep = counts > 0
+    return low + np.flatnonzero(keep) * width, values[keep], counts[keep]
+
+
+def downsample(timestamps, values, points=DEFAULT_POINTS, method='lttb', aggregate='sum'):
+    """Колоночный ряд {dates, values[, counts]} не длиннее points.
+
+    timestamps - unix-время в секундах. lttb отбирает исходные точки, bucket агрегирует их по равным
+    интервалам времени (aggregate: sum, mean или max) и добавляет число точек в интервале.
+    """
+    x = np.asarray(timestamps, dtype=np.float64)
+    y = np.asarray(values, dtype=np.float64)
+    valid = ~(np.isnan(x) | np.isnan(y))
+    x, y = x[valid], y[valid]
+    order = np.argsort(x, kind='stable')
+    x, y = x[order], y[order]
+
+    result = {'total': len(x)}
+    if method == 'bucket':
+        if len(x) > points:
+            x, y, counts = time_buckets(x, y, points, aggregate)
+        else:
+            counts = np.ones(len(x), dtype=np.intp)
+        result['counts'] = counts.tolist()
+    else:
+        keep = lttb(x, y, points)
+        x, y = x[keep], y[keep]
+    result['dates'] = x.astype(np.int64).astype('datetime64[s]').astype(str).tolist()
+    result['values'] = np.round(y, 2).tolist()
+    return result
@@ -0,0 +1,154 @@
+# Снимки данных API и их замена без перезапуска сервера (горячая перезагрузка).
+import os
+import threading
+import traceback
+
+# Период опроса источника данных фоновым наблюдателем, секунды
+WATCH_INTERVAL = 10
+
+
+def data_file(path, data_dir):
+    """Абсолютный путь к существующему файлу path внутри data_dir (относительный path - от data_dir).
+
+    Для /admin/reload: иначе эндпоинт открывал бы любой файл сервера. Путь вне каталога - ValueError.
+    """
+    root = os.path.realpath(data_dir)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise ValueError(f"Файл {path} вне каталога данных {data_dir}")
+    if not os.path.isfile(resolved):
+        raise ValueError(f"Файл {path} не найден")
+    return resolved
+
+
+class Snapshot:
+    """Ресурсы одной версии данных (пулы соединений, кадры, индексы), доступные как атрибуты.
+
+    Снимок закрывается (close), когда он заменён новым и его больше не использует ни один запрос.
+    """
+
+    def __init__(self, version, close=None, **resources):
+        self.version = version
+        self._close = close
+        self._users = 0
+        self._retired = False
+        self.__dict__.update(resources)
+
+    def _finish(self):
+        if self._close is not None:
+            self._close()
+
+
+class SnapshotManager:
+    """Хранит текущий снимок и атомарно подменяет его новым.
+
+    Запрос берёт снимок в начале (acquire или Depends(manager.dependency)) и работает с ним до конца,
+    даже если за это время данные перезагрузили. Новый снимок строится и прогревается загрузчиком load
+    до подмены, поэтому перезагрузка не даёт ни простоя, ни холодного старта.
+    """
+
+    def __init__(self, load):
+        self._load = load
+        self._params = {}
+        self._lock = threading.Lock()  # Подмена и счётчики использования
+        self._reload_lock = threading.Lock()  # Одна перезагрузка за раз
+        self._current = None
+        self._stop = threading.Event()
+        self._watcher = None
+        self._listeners = []
+
+    @property
+    def current(self):
+        return self._current
+
+    def acquire(self):
+        with self._lock:
+            snapshot = self._current
+            snapshot._users += 1
+        return snapshot
+
+    def release(self, snapshot):
+        with self._lock:
+            snapshot._users -= 1
+            finished = snapshot._retired and snapshot._users == 0
+        if finished:
+            snapshot._finish()
+
+    def dependency(self):
+        """Зависимость FastAPI: текущий снимок на время обработки запроса."""
+        snapshot = self.acquire()
+        try:
+            yield snapshot
+        finally:
+            self.release(snapshot)
+
+    def _retire(self, snapshot):
+        with self._lock:
+            snapshot._retired = True
+            finished = snapshot._users == 0
+        if finished:
+            snapshot._finish()
+
+    def reload(self, **params):
+        """Строит снимок загрузчиком и делает его текущим; возвращает новый снимок.
+
+        Параметры со значением None берутся из прошлой загрузки (например, путь к базе).
+        Если загрузчик упал, текущий снимок остаётся прежним.
+        """
+        with self._reload_lock:
+            params = {**self._params, **{key: value for key, value in params.items() if value is not None}}
+            snapshot = self._load(**params)
+            self._params = params
+            with self._lock:
+                previous, self._current = self._current, snapshot
+            if previous is not None:
+                self._retire(previous)
+            for listener in self._listeners:
+                listener(snapshot)
+        print(f"Snapshot loaded: version {snapshot.version}")
+        return snapshot
+
+    def on_reload(self, listener):
+        """listener(snapshot) вызывается после каждой подмены снимка (например, очистка кэшей)."""
+        self._listeners.append(listener)
+
+    def watch(self, probe, interval=WATCH_INTERVAL):
+        """Запускает фоновый поток, который вызывает reload(), когда меняется probe(текущий снимок)."""
+        if self._watcher is not None:
+            return
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch, args=(probe, interval), name='snapshot-watcher',
+                                         daemon=True)
+        self._watcher.start()
+
+    def _probe(self, probe):
+        snapshot = self.acquire()
+        try:
+            return probe(snapshot)
+        finally:
+            self.release(snapshot)
+
+    def _watch(self, probe, interval):
+        try:
+            state = self._probe(probe)
+        except Exception:
+            traceback.print_exc()
+            state = None
+        while not self._stop.wait(interval):
+            try:
+                if self._probe(probe) != state:
+                    self.reload()
+                    state = self._probe(probe)
+            except Exception:
+                traceback.print_exc()  # Источник мог быть в процессе записи - попробуем на следующем шаге
+
+    def close(self):
+        """Останавливает наблюдателя и закрывает текущий снимок после последнего запроса."""
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
+        with self._lock:
+            snapshot, self._current = self._current, None
+        if snapshot is not None:
+            self._retire(snapshot)
@@ -0,0 +1,139 @@
+# Поиск поставщиков по ИНН и наименованию для автодополнения (/inns в main.py).
+import re
+from itertools import accumulate
+
+import numpy as np
+
+# Сколько подсказок возвращать по умолчанию
+DEFAULT_LIMIT = 20
+
+TOKEN = re.compile(r'\w+')
+
+
+def normalize(text):
+    """Приводит строку к виду для сравнения: без регистра, ё -> е."""
+    return str(text).casefold().replace('ё', 'е')
+
+
+def tokenize(text):
+    return TOKEN.findall(normalize(text))
+
+
+def _prefix_range(keys, prefix):
+    """Позиции [start, stop) ключей отсортированного массива, начинающихся с prefix."""
+    return int(np.searchsorted(keys, prefix)), int(np.searchsorted(keys, prefix + '\uffff'))
+
+
+def _sorted_keys(keys, ids):
+    """Ключи по возрастанию и соответствующие им ids. Сортируются сами строки, а не кортежи - так быстрее."""
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    return [keys[i] for i in order], [ids[i] for i in order]
+
+
+class SupplierIndex:
+    """Префиксный индекс по ИНН, полному наименованию и отдельным словам наименования.
+
+    Индекс строится один раз при конвертации выгрузки (dataset_store) и хранится массивами numpy,
+    которые процессы открывают через mmap; поиск - бинарный поиск по отсортированным ключам,
+    поэтому время ответа не зависит от числа поставщиков.
+    Порядок выдачи: совпадение с началом ИНН, с началом наименования, с началом слова наименования.
+    """
+
+    def __init__(self, inns, names, inn_keys, inn_ids, name_keys, name_ids, token_keys, token_offsets, postings):
+        # Поставщики по возрастанию (ИНН, наименование)
+        self.inns = inns
+        self.names = names
+        self._inn_keys, self._inn_ids = inn_keys, inn_ids
+        self._name_keys, self._name_ids = name_keys, name_ids
+        # Слово token_keys[j] -> номера поставщиков postings[token_offsets[j]:token_offsets[j + 1]]
+        self._token_keys, self._token_offsets, self._postings = token_keys, token_offsets, postings
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        # Пары без пропусков, отсортированные по ИНН (name == name отсеивает NaN)
+        entries = sorted(set((inn, name) for inn, name in pairs if inn == inn and name == name))
+        tokens = [tuple(tokenize(name)) for _, name in entries]
+
+        inn_keys, inn_ids = _sorted_keys([str(inn) for inn, _ in entries], range(len(entries)))
+        name_keys, name_ids = _sorted_keys([' '.join(words) for words in tokens], range(len(entries)))
+        # Слово -> номера поставщиков по возрастанию ИНН; сортируются только различные слова
+        postings = {}
+        for i, words in enumerate(tokens):
+            for token in words:
+                ids = postings.setdefault(token, [])
+                if not ids or ids[-1] != i:
+                    ids.append(i)
+        token_keys = sorted(postings)
+        # Накопленное число ссылок: сколько кандидатов даст префикс, считается за O(log n)
+        token_offsets = [0, *accumulate(len(postings[token]) for token in token_keys)]
+        return cls(np.array([inn for inn, _ in entries]), np.array([name for _, name in entries], dtype=str),
+                   np.array(inn_keys, dtype=str), np.array(inn_ids, dtype=np.int64),
+                   np.array(name_keys, dtype=str), np.array(name_ids, dtype=np.int64),
+                   np.array(token_keys, dtype=str), np.array(token_offsets, dtype=np.int64),
+                   np.array([i for token in token_keys for i in postings[token]], dtype=np.int64))
+
+    @classmethod
+    def from_frame(cls, frame, inn_column, name_column):
+        return cls.from_pairs(frame[[inn_column, name_column]].drop_duplicates().itertuples(index=False, name=None))
+
+    def arrays(self):
+        return {'inns': self.inns, 'names': self.names, 'inn_keys': self._inn_keys, 'inn_ids': self._inn_ids,
+                'name_keys': self._name_keys, 'name_ids': self._name_ids, 'token_keys': self._token_keys,
+                'token_offsets': self._token_offsets, 'postings': self._postings}
+
+    def __len__(self):
+        return len(self.inns)
+
+    @property
+    def entries(self):
+        """Все поставщики: список (inn, name) по возрастанию ИНН."""
+        return list(zip(self.inns.tolist(), self.names.tolist()))
+
+    def _entry(self, i):
+        return self.inns[i].item(), self.names[i].item()
+
+    def _matches(self, i, query_tokens):
+        # Каждое слово запроса - начало какого-либо слова наименования
+        words = tokenize(self.names[i])
+        return all(any(token.startswith(q) for token in words) for q in query_tokens)
+
+    def search(self, q, limit=DEFAULT_LIMIT):
+        """Список (inn, name) для строки запроса q, не больше limit элементов."""
+        query_tokens = tokenize(q)
+        if not query_tokens:
+            return []
+        found = {}
+
+        def take(candidates, check):
+            for i in candidates:
+                if i not in found and (not check or self._matches(i, query_tokens)):
+                    found[i] = None
+                    if len(found) >= limit:
+                        return True
+            return False
+
+        def ranged(keys, ids, prefix):
+            start, stop = _prefix_range(keys, prefix)
+            return iter(ids[start:stop])
+
+        def by_token(prefix):
+            start, stop = _prefix_range(self._token_keys, prefix)
+            # Ссылки слов с префиксом идут подряд
+            return iter(self._postings[self._token_offsets[start]:self._token_offsets[stop]])
+
+        def selectivity(prefix):
+            start, stop = _prefix_range(self._token_keys, prefix)
+            return self._token_offsets[stop] - self._token_offsets[start]
+
+        # Кандидатов отбирает самое редкое слово запроса, остальные проверяются
+        rarest = min(query_tokens, key=selectivity)
+        sources = [
+            (ranged(self._name_keys, self._name_ids, ' '.join(query_tokens)), False),
+            (by_token(rarest), len(query_tokens) > 1),
+        ]
+        if len(query_tokens) == 1:
+            sources.insert(0, (ranged(self._inn_keys, self._inn_ids, query_tokens[0]), False))
+        for candidates, check in sources:
+            if take(candidates, check):
+                break
+        return [self._entry(i) for i in found]